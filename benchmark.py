@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+BENCHMARK.PY - Offline micro-benchmarks for hot code paths
+Runs without Telegram or MongoDB:
+
+    python benchmark.py hydration --count 100000
+    python benchmark.py metadata --count 300000 [--corpus filenames.txt]
+"""
+
+import argparse
+import random
+import string
+import time
+import tracemalloc
+from datetime import datetime
+
+import bson
+
+from bot import Book, BookSummary, FileProcessor, LISTING_PROJECTION
+
+
+def make_book_doc(i: int) -> dict:
+    """Synthetic book document shaped like the ones handle_file_upload stores"""
+    words = ["".join(random.choices(string.ascii_lowercase, k=random.randint(3, 10))) for _ in range(6)]
+    title = " ".join(words).title()
+    return {
+        "id": f"{i:08X}",
+        "title": title,
+        "author": " ".join(random.choices(words, k=2)).title(),
+        "file_id": str(100000 + i),
+        "file_type": random.choice(["PDF", "EPUB", "MOBI"]),
+        "file_size": random.randint(100_000, 50_000_000),
+        "file_name": f"{title}.pdf",
+        "category": random.choice(["Programming", "Science", "Fiction", "General"]),
+        "rating": round(random.uniform(0, 5), 1),
+        "downloads": random.randint(0, 10_000),
+        "added_by": 123456789,
+        "added_date": datetime.now(),
+        "tags": random.sample(words, 3),
+    }
+
+
+def project(doc: dict, projection: dict) -> dict:
+    """Apply an inclusion projection the way MongoDB would"""
+    return {field: doc[field] for field, keep in projection.items() if keep and field in doc}
+
+
+def measure(label: str, docs: list, hydrate) -> None:
+    """Report hydration time, retained memory and wire size for one view"""
+    start = time.perf_counter()
+    for doc in docs:
+        hydrate(doc)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    records = [hydrate(doc) for doc in docs]
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+
+    wire = sum(len(bson.encode(doc)) for doc in docs)
+    count = len(docs)
+    print(f"{label:<22} {elapsed * 1e6 / count:8.2f} µs/book  "
+          f"{retained / count:8.1f} B/book retained  {wire / count:8.1f} B/book on the wire")
+
+
+def bench_hydration(args) -> None:
+    """Full Book documents vs listing projection into BookSummary"""
+    random.seed(args.seed)
+    full_docs = [make_book_doc(i) for i in range(args.count)]
+    listing_docs = [project(doc, LISTING_PROJECTION) for doc in full_docs]
+
+    print(f"📚 Hydrating {args.count:,} books")
+    print("-" * 90)
+    measure("Book (full document)", full_docs, Book.from_doc)
+    measure("BookSummary (listing)", listing_docs, BookSummary.from_doc)
+
+
+TITLE_WORDS = [
+    "python", "java", "javascript", "data", "science", "analysis", "machine", "learning", "history",
+    "rome", "rain", "forest", "said", "story", "novel", "cooking", "recipes", "finance", "business",
+    "marketing", "physics", "chemistry", "mathematics", "guide", "introduction", "advanced", "complete",
+    "handbook", "modern", "the", "of", "and", "for", "beginners", "c++", "html", "css", "ai", "kai",
+]
+AUTHORS = ["Eric Matthes", "Mark Lutz", "Yuval Noah Harari", "Jamie Oliver", "Al Sweigart", "Mary Beard"]
+
+
+def make_filename() -> str:
+    """Synthetic filename in the shapes admins actually upload"""
+    title = " ".join(random.choices(TITLE_WORDS, k=random.randint(2, 7))).title()
+    author = random.choice(AUTHORS)
+    shape = random.randint(0, 5)
+    if shape == 0:
+        name = f"{title} by {author}"
+    elif shape == 1:
+        name = f"{author} - {title}"
+    elif shape == 2:
+        name = f"{title} ({author})"
+    elif shape == 3:
+        name = f"{title} ({random.randint(1950, 2024)})"
+    elif shape == 4:
+        name = f"[{title}] {random.randint(1, 9)}th Edition"
+    else:
+        name = title.replace(" ", "_")
+    return f"{name}.{random.choice(['pdf', 'epub', 'mobi'])}"
+
+
+def bench_metadata(args) -> None:
+    """Filename metadata extraction throughput, per call and batched"""
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as f:
+            filenames = [line.strip() for line in f if line.strip()]
+    else:
+        random.seed(args.seed)
+        filenames = [make_filename() for _ in range(args.count)]
+    count = len(filenames)
+
+    print(f"🏷️ Extracting metadata from {count:,} filenames")
+    print("-" * 90)
+
+    start = time.perf_counter()
+    for filename in filenames:
+        FileProcessor.extract_metadata_sync(filename)
+    elapsed = time.perf_counter() - start
+    print(f"{'extract_metadata_sync':<24} {count / elapsed:12,.0f} files/s  {elapsed * 1e6 / count:8.2f} µs/file")
+
+    start = time.perf_counter()
+    results = FileProcessor.extract_metadata_batch(filenames)
+    elapsed = time.perf_counter() - start
+    print(f"{'extract_metadata_batch':<24} {count / elapsed:12,.0f} files/s  {elapsed * 1e6 / count:8.2f} µs/file")
+
+    categories = {}
+    for metadata in results:
+        categories[metadata["category"]] = categories.get(metadata["category"], 0) + 1
+    print("\nCategories: " + ", ".join(f"{name} {n / count:.1%}" for name, n in
+                                      sorted(categories.items(), key=lambda item: -item[1])))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Book bot micro-benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    hydration = subparsers.add_parser("hydration", help="Book hydration: full vs listing projection")
+    hydration.add_argument("--count", type=int, default=100_000)
+    hydration.add_argument("--seed", type=int, default=42)
+    hydration.set_defaults(func=bench_hydration)
+
+    metadata = subparsers.add_parser("metadata", help="Filename metadata extraction throughput")
+    metadata.add_argument("--count", type=int, default=300_000)
+    metadata.add_argument("--corpus", help="File with one real filename per line (overrides --count)")
+    metadata.add_argument("--seed", type=int, default=42)
+    metadata.set_defaults(func=bench_metadata)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
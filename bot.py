@@ -7,13 +7,23 @@ Deploy on Render.com
 import os
 import asyncio
 import logging
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Set
 from dataclasses import dataclass
 import json
+import contextlib
+import contextvars
+import functools
+import inspect
 import random
 import uuid
 import re
+import bisect
+import heapq
+import math
+import sys
+import time
+from collections import OrderedDict, deque
 
 # Third-party imports
 from pyrogram import Client, filters, idle
@@ -22,7 +32,13 @@ from pyrogram.types import (
     InlineKeyboardButton, CallbackQuery
 )
 from pyrogram.enums import ParseMode
+from pyrogram.errors import (
+    FloodWait, UserIsBlocked, InputUserDeactivated,
+    UserDeactivated, UserDeactivatedBan, PeerIdInvalid
+)
 import motor.motor_asyncio
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -54,9 +70,59 @@ class Config:
     
     # Bot Behavior
     AUTO_DELETE_SEARCHES = os.getenv("AUTO_DELETE_SEARCHES", "true").lower() == "true"
+    AUTO_DELETE_DELAY = int(os.getenv("AUTO_DELETE_DELAY", "600"))  # seconds
+    
+    # Per-user search sessions kept in memory
+    SESSION_MAX_ENTRIES = int(os.getenv("SESSION_MAX_ENTRIES", "50000"))
+    SESSION_TTL = int(os.getenv("SESSION_TTL", "3600"))  # seconds since last use
     REACTION_PROBABILITY = float(os.getenv("REACTION_PROBABILITY", "0.4"))
     ENABLE_BROADCAST = os.getenv("ENABLE_BROADCAST", "true").lower() == "true"
     
+    # Search: "index" (in-memory inverted index), "text" (MongoDB text index) or "regex"
+    SEARCH_MODE = os.getenv("SEARCH_MODE", "index").lower()
+    SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "2000"))
+    SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "300"))  # seconds
+    SEARCH_COUNT_LIMIT = int(os.getenv("SEARCH_COUNT_LIMIT", "1000"))  # cap for estimated totals
+    
+    # Write-behind counters (searches, downloads, stats)
+    COUNTER_FLUSH_INTERVAL = float(os.getenv("COUNTER_FLUSH_INTERVAL", "5"))  # seconds
+    COUNTER_MAX_PENDING = int(os.getenv("COUNTER_MAX_PENDING", "1000"))  # distinct documents
+    
+    # Trending
+    TRENDING_HALF_LIFE_HOURS = float(os.getenv("TRENDING_HALF_LIFE_HOURS", "6"))
+    TRENDING_WINDOW_HOURS = int(os.getenv("TRENDING_WINDOW_HOURS", "24"))
+    TRENDING_REFRESH_INTERVAL = int(os.getenv("TRENDING_REFRESH_INTERVAL", "60"))  # seconds
+    TRENDING_TOP_K = int(os.getenv("TRENDING_TOP_K", "50"))
+    
+    # Broadcast throughput (Telegram allows ~30 msg/s globally and ~1 msg/s per chat)
+    BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "20"))
+    BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))  # messages per second
+    BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))  # seconds
+    
+    # Slow-request tracing
+    TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "1000"))  # updates slower than this are dumped
+    TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "1.0"))  # fraction of slow traces kept
+    TRACE_FILE = os.getenv("TRACE_FILE", "slow_traces.jsonl")
+    TRACE_TO_LOG_CHANNEL = os.getenv("TRACE_TO_LOG_CHANNEL", "false").lower() == "true"
+    
+    # Prometheus metrics endpoint (METRICS_PORT=0 disables it)
+    METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "9091"))
+    
+    # Outbound Telegram requests (shared by every sender)
+    OUTBOUND_RATE = float(os.getenv("OUTBOUND_RATE", "28"))  # requests per second, all lanes
+    OUTBOUND_PER_CHAT_INTERVAL = float(os.getenv("OUTBOUND_PER_CHAT_INTERVAL", "1.0"))  # seconds between requests to one chat
+    
+    # Admin upload ingestion
+    INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+    INGEST_INSERT_BATCH = int(os.getenv("INGEST_INSERT_BATCH", "100"))
+    INGEST_PROGRESS_INTERVAL = float(os.getenv("INGEST_PROGRESS_INTERVAL", "3"))  # seconds
+    INGEST_BATCH_IDLE = float(os.getenv("INGEST_BATCH_IDLE", "10"))  # seconds without uploads closes a batch
+    
+    # Catalog reindex from DATABASE_CHANNEL_ID
+    REINDEX_CHUNK = min(int(os.getenv("REINDEX_CHUNK", "200")), 200)  # get_messages accepts at most 200 ids
+    REINDEX_PROGRESS_INTERVAL = float(os.getenv("REINDEX_PROGRESS_INTERVAL", "5"))  # seconds
+    
     # MongoDB
     MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
     DATABASE_NAME = os.getenv("DATABASE_NAME", "book_bot")
@@ -79,6 +145,7 @@ class Book:
     added_by: int = 0
     added_date: datetime = None
     tags: List[str] = None
+    file_unique_id: str = None  # Telegram's stable id for the file content
     
     def __post_init__(self):
         if self.added_date is None:
@@ -96,12 +163,82 @@ class Book:
             "file_size": self.file_size,
             "file_name": self.file_name,
             "category": self.category,
+            "category_key": self.category_key(self.category),
             "rating": self.rating,
             "downloads": self.downloads,
             "added_by": self.added_by,
             "added_date": self.added_date,
-            "tags": self.tags
+            "tags": self.tags,
+            "file_unique_id": self.file_unique_id
         }
+    
+    @classmethod
+    def from_doc(cls, doc: Dict) -> "Book":
+        """Build a Book from a (possibly projected) MongoDB document"""
+        return cls(
+            id=doc.get("id", ""),
+            title=doc.get("title", ""),
+            author=doc.get("author", ""),
+            file_id=doc.get("file_id", ""),
+            file_type=doc.get("file_type", ""),
+            file_size=doc.get("file_size", 0),
+            file_name=doc.get("file_name", ""),
+            category=doc.get("category", "General"),
+            rating=doc.get("rating", 0.0),
+            downloads=doc.get("downloads", 0),
+            added_by=doc.get("added_by", 0),
+            added_date=doc.get("added_date"),
+            tags=doc.get("tags", []),
+            file_unique_id=doc.get("file_unique_id")
+        )
+    
+    @staticmethod
+    def category_key(category: str) -> str:
+        """Case- and whitespace-normalized category, stored so lookups can use a plain index"""
+        return " ".join((category or "").lower().split())
+
+class BookSummary:
+    """Compact read-only book record for list views"""
+    
+    __slots__ = ("id", "title", "author", "file_type", "file_size", "category", "rating", "downloads")
+    
+    def __init__(self, id: str, title: str = "", author: str = "", file_type: str = "",
+                 file_size: int = 0, category: str = "General", rating: float = 0.0, downloads: int = 0):
+        self.id = id
+        self.title = title
+        self.author = author
+        self.file_type = file_type
+        self.file_size = file_size
+        self.category = category
+        self.rating = rating
+        self.downloads = downloads
+    
+    @classmethod
+    def from_doc(cls, doc: Dict) -> "BookSummary":
+        """Build a summary from a listing-projected MongoDB document"""
+        return cls(
+            doc.get("id", ""),
+            doc.get("title", ""),
+            doc.get("author", ""),
+            doc.get("file_type", ""),
+            doc.get("file_size", 0),
+            doc.get("category", "General"),
+            doc.get("rating", 0.0),
+            doc.get("downloads", 0)
+        )
+    
+    def __repr__(self):
+        return f"BookSummary(id={self.id!r}, title={self.title!r})"
+
+# Field projections per view: what each screen actually needs from a book
+LISTING_PROJECTION = {"_id": 0, **{field: 1 for field in BookSummary.__slots__}}
+DELIVERY_PROJECTION = {"_id": 0, "id": 1, "title": 1, "author": 1, "file_id": 1, "file_type": 1}
+
+BOOK_VIEWS = {
+    "full": (None, Book.from_doc),
+    "listing": (LISTING_PROJECTION, BookSummary.from_doc),
+    "delivery": (DELIVERY_PROJECTION, Book.from_doc),
+}
 
 @dataclass
 class User:
@@ -137,8 +274,737 @@ class User:
             "wishlist": self.wishlist,
             "last_active": self.last_active
         }
+    
+    @classmethod
+    def from_doc(cls, doc: Dict) -> "User":
+        """Build a User from a MongoDB document"""
+        return cls(
+            id=doc.get("id", 0),
+            username=doc.get("username", ""),
+            first_name=doc.get("first_name", ""),
+            last_name=doc.get("last_name", ""),
+            joined_date=doc.get("joined_date"),
+            searches=doc.get("searches", 0),
+            downloads=doc.get("downloads", 0),
+            is_premium=doc.get("is_premium", False),
+            wishlist=doc.get("wishlist", []),
+            last_active=doc.get("last_active")
+        )
+
+# ========== METRICS ==========
+class LatencyHistogram:
+    """Fixed-bucket latency histogram (seconds), cheap enough to observe every request"""
+    
+    BOUNDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)  # last bucket is +Inf
+        self.count = 0
+        self.sum = 0.0
+    
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+    
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by interpolating inside its bucket"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.BOUNDS[i - 1] if i else 0.0
+                upper = self.BOUNDS[i] if i < len(self.BOUNDS) else self.BOUNDS[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.BOUNDS[-1]
+    
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+class Metrics:
+    """Process-wide latency histograms and gauges, served in Prometheus text format"""
+    
+    def __init__(self):
+        self.started = time.time()
+        self.in_flight = 0
+        self.loop_lag = 0.0
+        self._help: Dict[str, str] = {}
+        self._histograms: Dict[str, Dict[tuple, LatencyHistogram]] = {}
+        self._histogram_sources: Dict[str, object] = {}  # name -> fn() yielding (labels, histogram)
+        self._gauges: Dict[str, tuple] = {}  # name -> (type, fn() returning a number or {labels: number})
+    
+    @property
+    def uptime(self) -> float:
+        return time.time() - self.started
+    
+    def observe(self, name: str, seconds: float, **labels):
+        series = self._histograms.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = LatencyHistogram()
+        histogram.observe(seconds)
+    
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+    
+    def format_uptime(self) -> str:
+        minutes, _ = divmod(int(self.uptime), 60)
+        hours, minutes = divmod(minutes, 60)
+        days, hours = divmod(hours, 24)
+        return f"{days}d {hours}h {minutes}m" if days else f"{hours}h {minutes}m"
+    
+    def histogram_source(self, name: str, help_text: str, source):
+        """Expose histograms owned elsewhere (e.g. callback routes)"""
+        self._help[name] = help_text
+        self._histogram_sources[name] = source
+    
+    def gauge(self, name: str, help_text: str, read, kind: str = "gauge"):
+        """Expose a value read at scrape time; kind="counter" for monotonic totals"""
+        self._help[name] = help_text
+        self._gauges[name] = (kind, read)
+    
+    @staticmethod
+    def rss_bytes() -> int:
+        """Resident set size of this process"""
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    
+    async def watch_event_loop(self, interval: float = 0.5):
+        """Measure how late the loop wakes up from a fixed sleep"""
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(interval)
+            self.loop_lag = max(0.0, time.monotonic() - start - interval)
+            self.observe("bot_event_loop_lag_seconds", self.loop_lag)
+    
+    @staticmethod
+    def _labels(labels: Dict, **extra) -> str:
+        items = {**labels, **extra}
+        if not items:
+            return ""
+        escaped = (
+            f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34)).replace(chr(10), " ")}"'
+            for key, value in items.items()
+        )
+        return "{" + ",".join(escaped) + "}"
+    
+    def _render_histogram(self, lines: List[str], name: str, series: Iterable[tuple]):
+        lines.append(f"# HELP {name} {self._help.get(name, name)}")
+        lines.append(f"# TYPE {name} histogram")
+        for labels, histogram in series:
+            cumulative = 0
+            for bound, bucket_count in zip(LatencyHistogram.BOUNDS, histogram.counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{self._labels(labels, le=bound)} {cumulative}")
+            lines.append(f"{name}_bucket{self._labels(labels, le='+Inf')} {histogram.count}")
+            lines.append(f"{name}_sum{self._labels(labels)} {histogram.sum:.6f}")
+            lines.append(f"{name}_count{self._labels(labels)} {histogram.count}")
+    
+    def render(self) -> str:
+        lines: List[str] = []
+        for name, series in self._histograms.items():
+            self._render_histogram(lines, name, ((dict(key), histogram) for key, histogram in series.items()))
+        for name, source in self._histogram_sources.items():
+            self._render_histogram(lines, name, source())
+        
+        for name, (kind, read) in self._gauges.items():
+            try:
+                value = read()
+            except Exception as e:
+                logger.debug(f"Metric {name} unavailable: {e}")
+                continue
+            lines.append(f"# HELP {name} {self._help.get(name, name)}")
+            lines.append(f"# TYPE {name} {kind}")
+            if isinstance(value, dict):
+                for labels, sample in value.items():
+                    lines.append(f"{name}{self._labels(dict(labels))} {sample}")
+            else:
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+    
+    async def _handle_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass  # skip headers
+            
+            parts = request_line.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", self.render().encode()
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except Exception as e:
+            logger.debug(f"Metrics request failed: {e}")
+        finally:
+            writer.close()
+    
+    async def serve(self, host: str, port: int):
+        """Serve GET /metrics until cancelled"""
+        server = await asyncio.start_server(self._handle_http, host, port)
+        logger.info(f"📈 Metrics on http://{host}:{port}/metrics")
+        async with server:
+            await server.serve_forever()
+
+def instrumented(kind: str):
+    """Record latency, in-flight count and a trace for an update handler (apply below @app.on_*)"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(client, update, *args, **kwargs):
+            metrics.in_flight += 1
+            start = time.perf_counter()
+            user = getattr(update, "from_user", None)
+            try:
+                with tracer.trace(func.__name__, kind=kind, user_id=user.id if user else None):
+                    return await func(client, update, *args, **kwargs)
+            finally:
+                metrics.in_flight -= 1
+                metrics.observe("bot_handler_seconds", time.perf_counter() - start, kind=kind, handler=func.__name__)
+        return wrapper
+    return decorator
+
+def timed_methods(metric: str):
+    """Class decorator timing every public coroutine method under `metric`"""
+    def wrap(name, method):
+        @functools.wraps(method)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                with tracer.span(f"db.{name}"):
+                    return await method(*args, **kwargs)
+            finally:
+                metrics.observe(metric, time.perf_counter() - start, method=name)
+        return wrapper
+    
+    def decorator(cls):
+        for name, attr in list(vars(cls).items()):
+            if not name.startswith("_") and inspect.iscoroutinefunction(attr):
+                setattr(cls, name, wrap(name, attr))
+        return cls
+    return decorator
+
+# ========== TRACING ==========
+class Span:
+    __slots__ = ("name", "start", "end", "attrs", "children", "root", "span_count")
+    
+    def __init__(self, name: str, root: "Span" = None, **attrs):
+        self.name = name
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attrs = attrs
+        self.children: List["Span"] = []
+        self.root = root or self
+        self.span_count = 1  # only meaningful on the root
+    
+    @property
+    def duration(self) -> float:
+        return ((self.end or time.perf_counter()) - self.start)
+    
+    def flatten(self, origin: float, depth: int = 0) -> List[Dict]:
+        """Spans in start order as offset/duration rows, for the JSON dump"""
+        rows = [{
+            "name": self.name,
+            "depth": depth,
+            "offset_ms": round((self.start - origin) * 1000, 2),
+            "duration_ms": round(self.duration * 1000, 2),
+            **({"attrs": self.attrs} if self.attrs else {}),
+        }]
+        for child in self.children:
+            rows.extend(child.flatten(origin, depth + 1))
+        return rows
+
+class Tracer:
+    """Per-update spans carried in a context variable.
+    
+    `trace()` opens a root span for an update; `span()` records a child of
+    whatever span is current and is a no-op outside a trace, so wrapped
+    database and Telegram calls cost almost nothing in background tasks.
+    Roots slower than `slow_seconds` are sampled and appended to a JSONL
+    file (and optionally posted to the log channel).
+    """
+    
+    MAX_SPANS = 500  # per trace; long-lived tasks spawned by a handler stop adding after this
+    
+    def __init__(self, slow_seconds: float = 1.0, sample_rate: float = 1.0,
+                 path: str = "slow_traces.jsonl", to_log_channel: bool = False):
+        self.slow_seconds = slow_seconds
+        self.sample_rate = sample_rate
+        self.path = path
+        self.to_log_channel = to_log_channel
+        self.current: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+        self.traces = 0
+        self.dumped = 0
+        self._posts: Set[asyncio.Task] = set()  # log-channel posts, referenced until they finish
+    
+    @contextlib.contextmanager
+    def trace(self, name: str, **attrs):
+        root = Span(name, **attrs)
+        token = self.current.set(root)
+        try:
+            yield root
+        finally:
+            root.end = time.perf_counter()
+            self.current.reset(token)
+            self.traces += 1
+            if root.duration >= self.slow_seconds and random.random() < self.sample_rate:
+                self._dump(root)
+    
+    @contextlib.contextmanager
+    def span(self, name: str, **attrs):
+        parent = self.current.get()
+        root = parent.root if parent else None
+        if root is None or root.end is not None or root.span_count >= self.MAX_SPANS:
+            yield None
+            return
+        
+        span = Span(name, root, **attrs)
+        root.span_count += 1
+        parent.children.append(span)
+        token = self.current.set(span)
+        try:
+            yield span
+        finally:
+            span.end = time.perf_counter()
+            self.current.reset(token)
+    
+    def _dump(self, root: Span):
+        record = {
+            "trace_id": uuid.uuid4().hex[:16],
+            "name": root.name,
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "duration_ms": round(root.duration * 1000, 2),
+            "attrs": root.attrs,
+            "spans": root.flatten(root.start)[1:],
+        }
+        self.dumped += 1
+        line = json.dumps(record, default=str)
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            logger.error(f"❌ Could not write slow trace: {e}")
+        
+        logger.warning(f"🐢 Slow update {root.name}: {record['duration_ms']:.0f}ms ({len(record['spans'])} spans)")
+        if self.to_log_channel:
+            steps = "\n".join(
+                f"{'  ' * row['depth']}{row['name']} +{row['offset_ms']:.0f}ms {row['duration_ms']:.0f}ms"
+                for row in record["spans"][:30]
+            )
+            task = asyncio.create_task(log_message(
+                f"🐢 **Slow update** `{root.name}` {record['duration_ms']:.0f}ms\n```\n{steps}\n```"
+            ))
+            self._posts.add(task)
+            task.add_done_callback(self._posts.discard)
+
+# ========== SEARCH INDEX ==========
+class SearchIndex:
+    """In-memory inverted index over book title, author, category and tags"""
+    
+    TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+    MIN_PREFIX_LEN = 2
+    
+    def __init__(self):
+        self.ready = False
+        self._doc_ids: List[str] = []          # docno -> book id
+        self._docnos: Dict[str, int] = {}      # book id -> docno
+        self._postings: Dict[str, Set[int]] = {}
+        self._vocab: List[str] = []            # sorted, for prefix lookups
+        self.generation = 0                    # bumped by each rebuild; docnos are not stable across it
+        self._building: Optional["SearchIndex"] = None
+        self._added_while_building: List[Dict] = []
+    
+    @classmethod
+    def tokenize(cls, text: str) -> List[str]:
+        """Split text into lowercase word tokens"""
+        if not text:
+            return []
+        return cls.TOKEN_RE.findall(text.lower())
+    
+    @classmethod
+    def document_tokens(cls, doc: Dict) -> Set[str]:
+        """Collect the searchable tokens of a book document"""
+        tokens = set()
+        for field in ("title", "author", "category"):
+            tokens.update(cls.tokenize(doc.get(field) or ""))
+        for tag in doc.get("tags") or []:
+            tokens.update(cls.tokenize(tag))
+        return tokens
+    
+    def __len__(self):
+        return len(self._doc_ids)
+    
+    def add(self, doc: Dict, keep_sorted: bool = True):
+        """Add a book document to the index"""
+        book_id = doc.get("id")
+        if not book_id or book_id in self._docnos:
+            return
+        if self._building is not None:
+            self._added_while_building.append(doc)
+        
+        docno = len(self._doc_ids)
+        self._doc_ids.append(book_id)
+        self._docnos[book_id] = docno
+        
+        for token in self.document_tokens(doc):
+            posting = self._postings.get(token)
+            if posting is None:
+                posting = self._postings[token] = set()
+                if keep_sorted:
+                    bisect.insort(self._vocab, token)
+                else:
+                    self._vocab.append(token)
+            posting.add(docno)
+    
+    async def build(self, collection):
+        """Build the index from the books collection.
+        
+        A fresh index is filled off to the side and its structures are swapped
+        in at once, so searches during a rebuild keep using the old one. Books
+        added meanwhile are replayed onto the new index before the swap.
+        """
+        fresh = SearchIndex()
+        self._building = fresh
+        try:
+            cursor = collection.find(
+                {},
+                {"_id": 0, "id": 1, "title": 1, "author": 1, "category": 1, "tags": 1}
+            ).sort("_id", 1).batch_size(1000)
+            
+            async for doc in cursor:
+                fresh.add(doc, keep_sorted=False)
+            fresh._vocab.sort()
+            
+            for doc in self._added_while_building:
+                fresh.add(doc)
+        finally:
+            self._building = None
+            self._added_while_building = []
+        
+        self._doc_ids, self._docnos, self._postings, self._vocab = (
+            fresh._doc_ids, fresh._docnos, fresh._postings, fresh._vocab
+        )
+        self.generation += 1
+        self.ready = True
+        logger.info(f"🗂️ Search index built: {len(self._doc_ids)} books, {len(self._vocab)} terms")
+    
+    def _term_postings(self, term: str) -> Set[int]:
+        """Postings for a query term, expanding it as a prefix when long enough"""
+        if len(term) < self.MIN_PREFIX_LEN:
+            return self._postings.get(term, set())
+        
+        vocab = self._vocab
+        i = bisect.bisect_left(vocab, term)
+        matched = []
+        while i < len(vocab) and vocab[i].startswith(term):
+            matched.append(self._postings[vocab[i]])
+            i += 1
+        
+        if len(matched) == 1:
+            return matched[0]
+        return set().union(*matched)
+    
+    def _match(self, query: str) -> Set[int]:
+        """Docnos of books matching every query term"""
+        terms = list(dict.fromkeys(self.tokenize(query)))
+        if not terms:
+            return set()
+        
+        postings = [self._term_postings(term) for term in terms]
+        postings.sort(key=len)
+        if not postings[0]:
+            return set()
+        
+        # Intersect starting from the shortest posting list
+        result = postings[0]
+        for posting in postings[1:]:
+            result = result & posting
+            if not result:
+                return set()
+        return result
+    
+    def search(self, query: str, limit: int = 50) -> List[str]:
+        """Return ids of books matching every query term, in catalog order"""
+        return [self._doc_ids[docno] for docno in heapq.nsmallest(limit, self._match(query))]
+    
+    def search_page(self, query: str, after: int = -1, page_size: int = 5):
+        """Return (ids, next docno or None, total matches) for the page after docno `after`"""
+        matched = self._match(query)
+        page = heapq.nsmallest(page_size + 1, (docno for docno in matched if docno > after))
+        next_docno = page[page_size - 1] if len(page) > page_size else None
+        return [self._doc_ids[docno] for docno in page[:page_size]], next_docno, len(matched)
+
+# ========== QUERY CACHE ==========
+class QueryCache:
+    """Bounded LRU cache with per-entry TTL and generation-based invalidation"""
+    
+    def __init__(self, max_size: int = 2000, ttl: int = 300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.generation = 0
+        self._entries = OrderedDict()  # key -> (generation, expires_at, value)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    @staticmethod
+    def make_key(query: str, *args) -> tuple:
+        """Normalize case and whitespace so equivalent queries share an entry"""
+        return (" ".join(query.lower().split()),) + args
+    
+    def get(self, key):
+        """Return a cached value, or None on a miss"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        generation, expires_at, value = entry
+        if generation != self.generation or expires_at < time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+    
+    def set(self, key, value):
+        """Store a value, evicting the least recently used entries when full"""
+        if self.max_size <= 0:
+            return
+        
+        self._entries[key] = (self.generation, time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def invalidate(self):
+        """Invalidate every entry by bumping the generation counter"""
+        self.generation += 1
+    
+    def stats(self) -> Dict:
+        """Counters for sizing the cache"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "generation": self.generation,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": (self.hits / lookups * 100) if lookups else 0.0
+        }
+
+# ========== COUNTER BUFFER ==========
+class CounterBuffer:
+    """Coalesces $inc updates in memory and flushes them with one bulk_write per collection"""
+    
+    def __init__(self, database, flush_interval: float = 5.0, max_pending: int = 1000):
+        self.database = database
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending: Dict[tuple, Dict[str, int]] = {}  # (collection, filter, upsert) -> {field: amount}
+        self._lock = asyncio.Lock()
+        self._flush_task = None
+        self.increments = 0
+        self.writes = 0
+        self.flushes = 0
+    
+    def incr(self, collection: str, filter: Dict, field: str, amount: int = 1, upsert: bool = False):
+        """Queue an increment; flushes early once max_pending documents are dirty"""
+        key = (collection, tuple(sorted(filter.items())), upsert)
+        fields = self._pending.setdefault(key, {})
+        fields[field] = fields.get(field, 0) + amount
+        self.increments += 1
+        
+        if len(self._pending) >= self.max_pending and not (self._flush_task and not self._flush_task.done()):
+            self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+    
+    async def flush(self):
+        """Write all pending increments"""
+        async with self._lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            
+            by_collection: Dict[str, list] = {}
+            for key, fields in pending.items():
+                by_collection.setdefault(key[0], []).append((key, fields))
+            
+            for collection, entries in by_collection.items():
+                ops = [
+                    UpdateOne(dict(filter_items), {"$inc": fields}, upsert=upsert)
+                    for (_, filter_items, upsert), fields in entries
+                ]
+                try:
+                    await self.database[collection].bulk_write(ops, ordered=False)
+                    self.writes += len(ops)
+                except BulkWriteError as e:
+                    # Unordered: only the ops listed in writeErrors were not applied
+                    failed = {error["index"] for error in e.details.get("writeErrors", [])}
+                    self.writes += len(ops) - len(failed)
+                    self._restore([entries[i] for i in failed])
+                    logger.error(f"❌ Counter flush error ({collection}, {len(failed)} of {len(ops)} ops kept for retry): {e}")
+                except Exception as e:
+                    self._restore(entries)
+                    logger.error(f"❌ Counter flush error ({collection}, {len(ops)} ops kept for retry): {e}")
+            self.flushes += 1
+    
+    def _restore(self, entries: List[tuple]):
+        """Merge a failed batch back into the buffer, on top of increments queued meanwhile"""
+        for key, fields in entries:
+            pending = self._pending.setdefault(key, {})
+            for field, amount in fields.items():
+                pending[field] = pending.get(field, 0) + amount
+    
+    async def run(self):
+        """Flush periodically until cancelled, then flush what is left"""
+        try:
+            while True:
+                await asyncio.sleep(self.flush_interval)
+                await self.flush()
+        except asyncio.CancelledError:
+            await self.drain()
+            raise
+    
+    async def drain(self, attempts: int = 3):
+        """Final flush at shutdown, retried while writes keep failing"""
+        for attempt in range(attempts):
+            await self.flush()
+            if not self._pending:
+                return
+            await asyncio.sleep(2 ** attempt)
+        logger.error(f"❌ {len(self._pending)} buffered counter documents could not be written at shutdown")
+    
+    def stats(self) -> Dict:
+        """Counters showing how many increments were coalesced"""
+        return {
+            "pending": len(self._pending),
+            "increments": self.increments,
+            "writes": self.writes,
+            "flushes": self.flushes
+        }
+
+# ========== TRENDING ENGINE ==========
+class TrendingEngine:
+    """Exponentially decayed download scores with hourly buckets and a cached top-K leaderboard"""
+    
+    BUCKET_SECONDS = 3600
+    RETENTION_DAYS = 7
+    
+    def __init__(self, collection, counters: CounterBuffer, half_life_hours: float = 6,
+                 window_hours: int = 24, top_k: int = 50):
+        self.collection = collection  # book_activity: {book_id, bucket, downloads}
+        self.counters = counters
+        self.decay = math.log(2) / (half_life_hours * 3600)
+        self.window_hours = window_hours
+        self.top_k = top_k
+        
+        # Scores are stored relative to _epoch: score(t) = stored * exp(-decay * (t - _epoch))
+        self._epoch = time.time()
+        self._scores: Dict[str, float] = {}
+        self._buckets: Dict[int, Dict[str, int]] = {}  # bucket start (unix) -> {book_id: downloads}
+        self.leaderboard: List[tuple] = []  # [(book_id, score, window_downloads)]
+        self.refreshed_at = None
+    
+    def _bucket(self, timestamp: float) -> int:
+        return int(timestamp // self.BUCKET_SECONDS * self.BUCKET_SECONDS)
+    
+    @staticmethod
+    def _bucket_key(bucket: int) -> datetime:
+        """Persisted bucket start; UTC so keys do not shift with the server timezone"""
+        return datetime.fromtimestamp(bucket, timezone.utc)
+    
+    @property
+    def window_label(self) -> str:
+        """The window is a rolling span ending now, not a calendar day"""
+        return f"last {self.window_hours}h"
+    
+    def _add(self, book_id: str, count: int, timestamp: float):
+        self._scores[book_id] = self._scores.get(book_id, 0.0) + count * math.exp(self.decay * (timestamp - self._epoch))
+        bucket = self._buckets.setdefault(self._bucket(timestamp), {})
+        bucket[book_id] = bucket.get(book_id, 0) + count
+    
+    def record(self, book_id: str, count: int = 1):
+        """Record a download event (persisted through the counter buffer)"""
+        now = time.time()
+        self._add(book_id, count, now)
+        self.counters.incr(
+            "book_activity",
+            {"book_id": book_id, "bucket": self._bucket_key(self._bucket(now))},
+            "downloads", count, upsert=True
+        )
+    
+    async def load(self):
+        """Rebuild scores and window counts from persisted buckets"""
+        horizon_hours = max(self.window_hours, math.log(1000) / self.decay / 3600)
+        since = self._bucket_key(self._bucket(time.time() - horizon_hours * 3600))
+        
+        cursor = self.collection.find({"bucket": {"$gte": since}}, {"_id": 0})
+        async for doc in cursor:
+            # Naive datetimes from the driver are UTC
+            bucket = doc["bucket"].replace(tzinfo=timezone.utc)
+            self._add(doc["book_id"], doc.get("downloads", 0), bucket.timestamp())
+        self.refresh()
+        logger.info(f"🔥 Trending loaded: {len(self._scores)} books active")
+    
+    def window_downloads(self, book_id: str) -> int:
+        """Downloads of a book inside the rolling trending window"""
+        return sum(bucket.get(book_id, 0) for bucket in self._buckets.values())
+    
+    def refresh(self):
+        """Recompute the top-K leaderboard, dropping negligible scores and old buckets"""
+        now = time.time()
+        
+        # Rebase before exp() grows large, which keeps the stored scores bounded
+        if self.decay * (now - self._epoch) > 50:
+            factor = math.exp(-self.decay * (now - self._epoch))
+            self._scores = {book_id: score * factor for book_id, score in self._scores.items()}
+            self._epoch = now
+        
+        current = math.exp(-self.decay * (now - self._epoch))
+        self._scores = {book_id: score for book_id, score in self._scores.items() if score * current >= 0.01}
+        
+        oldest = self._bucket(now) - (self.window_hours - 1) * self.BUCKET_SECONDS
+        self._buckets = {start: counts for start, counts in self._buckets.items() if start >= oldest}
+        
+        top = heapq.nlargest(self.top_k, self._scores.items(), key=lambda item: item[1])
+        self.leaderboard = [
+            (book_id, score * current, self.window_downloads(book_id)) for book_id, score in top
+        ]
+        self.refreshed_at = datetime.now(timezone.utc)
+    
+    async def run(self, interval: int = 60):
+        """Refresh the leaderboard periodically"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Trending refresh error: {e}")
 
 # ========== DATABASE MANAGER ==========
+@timed_methods("bot_db_seconds")
 class Database:
     def __init__(self):
         self.client = motor.motor_asyncio.AsyncIOMotorClient(config.MONGO_URI)
@@ -146,22 +1012,77 @@ class Database:
         self.books = self.db.books
         self.users = self.db.users
         self.stats = self.db.stats
+        self.search_index = SearchIndex()
+        self.search_cache = QueryCache(config.SEARCH_CACHE_SIZE, config.SEARCH_CACHE_TTL)
+        self.counters = CounterBuffer(self.db, config.COUNTER_FLUSH_INTERVAL, config.COUNTER_MAX_PENDING)
+        self.trending = TrendingEngine(
+            self.db.book_activity, self.counters,
+            config.TRENDING_HALF_LIFE_HOURS, config.TRENDING_WINDOW_HOURS, config.TRENDING_TOP_K
+        )
         
     async def initialize(self):
         """Create indexes on startup"""
         try:
             # Create text index for search
             await self.books.create_index([("title", "text"), ("author", "text"), ("category", "text")])
+            await self.books.create_index([("title", 1)])
+            await self.books.create_index([("author", 1)])
+            await self.books.create_index([("downloads", -1), ("id", 1)])
+            await self.books.create_index([("category", 1)])
+            await self.books.create_index([("category_key", 1)])
+            await self.books.create_index([("file_id", 1)])
+            await self.books.create_index(
+                [("file_unique_id", 1)], unique=True,
+                partialFilterExpression={"file_unique_id": {"$type": "string"}}
+            )
             await self.users.create_index([("id", 1)], unique=True)
+            await self.users.create_index([("blocked_at", 1), ("id", 1)])
             await self.stats.create_index([("key", 1)], unique=True)
+            await self.db.book_activity.create_index([("bucket", 1), ("book_id", 1)], unique=True)
+            await self.db.book_activity.create_index(
+                [("bucket", 1)], name="bucket_ttl",
+                expireAfterSeconds=TrendingEngine.RETENTION_DAYS * 86400
+            )
+            await self.db.broadcasts.create_index([("job_id", 1)], unique=True)
+            await self.db.broadcasts.create_index([("status", 1)])
+            await self.db.pending_deletions.create_index([("chat_id", 1), ("message_id", 1)], unique=True)
+            await self.db.reindex_jobs.create_index([("status", 1)])
             logger.info("✅ Database indexes created")
         except Exception as e:
             logger.error(f"❌ Database initialization error: {e}")
+        
+        # Own try block: existing duplicate ids must not stop the indexes above
+        try:
+            await self.books.create_index([("id", 1)], unique=True)
+        except Exception as e:
+            logger.error(f"❌ Unique book id index error (duplicate ids?): {e}")
+        
+        try:
+            await self.backfill_category_keys()
+        except Exception as e:
+            logger.error(f"❌ Category key backfill error: {e}")
+        
+        try:
+            await self.trending.load()
+        except Exception as e:
+            logger.error(f"❌ Trending load error: {e}")
+        
+        if config.SEARCH_MODE != "index":
+            return
+        
+        try:
+            await self.search_index.build(self.books)
+        except Exception as e:
+            logger.error(f"❌ Search index build error: {e}")
     
     async def add_book(self, book: Book) -> str:
         """Add a new book to database"""
         try:
-            await self.books.insert_one(book.to_dict())
+            doc = book.to_dict()
+            await self.books.insert_one(doc)
+            if self.search_index.ready:
+                self.search_index.add(doc)
+            self.search_cache.invalidate()
             await self.update_stats("total_books", 1)
             logger.info(f"📚 Book added: {book.title}")
             return book.id
@@ -169,155 +1090,415 @@ class Database:
             logger.error(f"❌ Error adding book: {e}")
             return ""
     
-    async def search_books(self, query: str, limit: int = 50) -> List[Book]:
-        """Search books by title, author, or tags"""
-        if not query:
-            return []
+    async def add_books(self, books: List[Book]) -> Set[str]:
+        """Add many books with one unordered insert_many; returns ids of the books inserted"""
+        if not books:
+            return set()
         
+        docs = [book.to_dict() for book in books]
+        failed = set()
         try:
-            results = []
+            await self.books.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+            failed = {error["index"] for error in write_errors}
+            logger.error(f"❌ {len(failed)} of {len(docs)} books failed to insert: {write_errors[:1]}")
+        except Exception as e:
+            logger.error(f"❌ Error adding books: {e}")
+            return set()
+        
+        inserted = [doc for i, doc in enumerate(docs) if i not in failed]
+        if self.search_index.ready:
+            for doc in inserted:
+                self.search_index.add(doc)
+        self.search_cache.invalidate()
+        await self.update_stats("total_books", len(inserted))
+        logger.info(f"📚 {len(inserted)} books added")
+        return {doc["id"] for doc in inserted}
+    
+    async def backfill_category_keys(self):
+        """Store category_key on books added before it existed (one update per distinct category)"""
+        missing = {"category_key": {"$exists": False}}
+        updated = 0
+        for category in await self.books.distinct("category", missing):
+            result = await self.books.update_many(
+                {**missing, "category": category},
+                {"$set": {"category_key": Book.category_key(category)}}
+            )
+            updated += result.modified_count
+        if updated:
+            logger.info(f"🏷️ Category keys backfilled on {updated} books")
+    
+    async def find_book_by_unique_id(self, file_unique_id: str) -> Optional[Dict]:
+        """Existing book for a Telegram file_unique_id (one indexed lookup)"""
+        if not file_unique_id:
+            return None
+        return await self.books.find_one({"file_unique_id": file_unique_id}, {"_id": 0, "id": 1, "title": 1})
+    
+    @staticmethod
+    def title_key(title: str) -> str:
+        """Normalized title used to spot duplicates uploaded before file_unique_id was stored"""
+        return "".join(ch for ch in title.lower() if ch.isalnum())
+    
+    async def merge_duplicates(self) -> Dict:
+        """Merge copies of one file into a single book.
+        
+        Books are grouped by file_unique_id. Older books stored without it join
+        the group of the one file_unique_id with the same size and normalized
+        title; if several files match they are left alone, and if none does they
+        are grouped among themselves by size and title. Books with no size or
+        an empty title are never grouped. The copy carrying file_unique_id (else
+        the oldest) is kept, downloads are summed into it and wishlists are
+        repointed to it. Returns counts plus the channel message ids of the
+        removed copies.
+        """
+        groups: Dict[tuple, List[Dict]] = {}
+        legacy: List[tuple] = []  # (size, title key), doc
+        unique_ids_by_shape: Dict[tuple, Set[str]] = {}
+        projection = {"_id": 0, "id": 1, "title": 1, "file_id": 1, "file_size": 1,
+                      "file_unique_id": 1, "downloads": 1, "rating": 1, "added_date": 1}
+        async for doc in self.books.find({}, projection).batch_size(1000):
+            shape = (doc.get("file_size") or 0, self.title_key(doc.get("title") or ""))
+            if doc.get("file_unique_id"):
+                groups.setdefault(("file", doc["file_unique_id"]), []).append(doc)
+                unique_ids_by_shape.setdefault(shape, set()).add(doc["file_unique_id"])
+            elif all(shape):
+                legacy.append((shape, doc))
+        
+        for shape, doc in legacy:
+            unique_ids = unique_ids_by_shape.get(shape)
+            if not unique_ids:
+                groups.setdefault(("shape",) + shape, []).append(doc)
+            elif len(unique_ids) == 1:
+                groups[("file", next(iter(unique_ids)))].append(doc)
+        
+        result = {"groups": 0, "removed": 0, "downloads_moved": 0, "channel_ids": []}
+        for docs in groups.values():
+            if len(docs) < 2:
+                continue
             
-            # Simple text search using MongoDB regex
-            regex_query = {"$regex": query, "$options": "i"}
+            docs.sort(key=lambda d: (not d.get("file_unique_id"), d.get("added_date") or datetime.max))
+            keeper, duplicates = docs[0], docs[1:]
+            dup_ids = [d["id"] for d in duplicates]
+            moved = sum(d.get("downloads", 0) for d in duplicates)
             
-            cursor = self.books.find({
-                "$or": [
-                    {"title": regex_query},
-                    {"author": regex_query},
-                    {"category": regex_query},
-                    {"tags": regex_query}
-                ]
-            }).limit(limit)
+            await self.books.update_one(
+                {"id": keeper["id"]},
+                {"$inc": {"downloads": moved},
+                 "$max": {"rating": max(d.get("rating", 0.0) for d in docs)}}
+            )
+            await self.users.update_many({"wishlist": {"$in": dup_ids}}, {"$addToSet": {"wishlist": keeper["id"]}})
+            await self.users.update_many({"wishlist": {"$in": dup_ids}}, {"$pullAll": {"wishlist": dup_ids}})
+            await self.books.delete_many({"id": {"$in": dup_ids}})
             
-            async for doc in cursor:
-                # Convert MongoDB document to Book object
-                book = Book(
-                    id=doc.get("id", ""),
-                    title=doc.get("title", ""),
-                    author=doc.get("author", ""),
-                    file_id=doc.get("file_id", ""),
-                    file_type=doc.get("file_type", ""),
-                    file_size=doc.get("file_size", 0),
-                    file_name=doc.get("file_name", ""),
-                    category=doc.get("category", "General"),
-                    rating=doc.get("rating", 0.0),
-                    downloads=doc.get("downloads", 0),
-                    added_by=doc.get("added_by", 0),
-                    added_date=doc.get("added_date"),
-                    tags=doc.get("tags", [])
-                )
-                results.append(book)
+            result["groups"] += 1
+            result["removed"] += len(dup_ids)
+            result["downloads_moved"] += moved
+            result["channel_ids"].extend(int(d["file_id"]) for d in duplicates if str(d.get("file_id", "")).isdigit())
+        
+        if result["removed"]:
+            await self.update_stats("total_books", -result["removed"])
+            if config.SEARCH_MODE == "index":
+                await self.search_index.build(self.books)
+            self.search_cache.invalidate()
+        logger.info(f"🧬 Dedupe merged {result['groups']} groups, removed {result['removed']} books")
+        return result
+    
+    async def search_book_ids(self, query: str, limit: int = 50) -> List[str]:
+        """Search books and return only the ordered ids of the matches"""
+        if not query:
+            return []
+        
+        cache_key = QueryCache.make_key(query, limit)
+        cached = self.search_cache.get(cache_key)
+        if cached is not None:
+            return list(cached)
+        
+        try:
+            if config.SEARCH_MODE == "index" and self.search_index.ready:
+                book_ids = self.search_index.search(query, limit)
+            elif config.SEARCH_MODE == "text":
+                docs = await self._text_search_docs(query, limit, {"_id": 0, "id": 1})
+                book_ids = [doc["id"] for doc in docs]
+            else:
+                docs = await self._regex_search_docs(query, limit, {"_id": 0, "id": 1})
+                book_ids = [doc["id"] for doc in docs]
             
-            logger.info(f"🔍 Search '{query}' found {len(results)} books")
-            return results
+            self.search_cache.set(cache_key, tuple(book_ids))
+            logger.info(f"🔍 Search '{query}' found {len(book_ids)} books")
+            return book_ids
         except Exception as e:
             logger.error(f"❌ Search error: {e}")
             return []
     
-    async def get_book(self, book_id: str) -> Optional[Book]:
+    async def search_books(self, query: str, limit: int = 50, view: str = "listing") -> List[Book]:
+        """Search books by title, author, or tags"""
+        book_ids = await self.search_book_ids(query, limit)
+        return await self.get_books_by_ids(book_ids, view)
+    
+    @staticmethod
+    def _regex_filter(query: str) -> Dict:
+        """Unanchored case-insensitive match across all searchable fields"""
+        regex_query = {"$regex": re.escape(query), "$options": "i"}
+        return {
+            "$or": [
+                {"title": regex_query},
+                {"author": regex_query},
+                {"category": regex_query},
+                {"tags": regex_query}
+            ]
+        }
+    
+    @staticmethod
+    def _prefix_filter(query: str) -> Dict:
+        """Anchored title/author prefix match used when the text index finds no whole words"""
+        prefix = {"$regex": f"^{re.escape(query)}", "$options": "i"}
+        return {"$or": [{"title": prefix}, {"author": prefix}]}
+    
+    def search_cursor_valid(self, cursor: Optional[str]) -> bool:
+        """Whether a continuation cursor belongs to the search path currently in use.
+        
+        Cursors are "i<generation>:<docno>" for the index, "t<offset>"/"p<offset>"
+        for the text index and its prefix fallback, and "<downloads>.<id>" for
+        regex. A result set created before the index finished building carries
+        regex cursors, which the index path cannot continue, and docnos from
+        before a rebuild point at different books.
+        """
+        if cursor is None:
+            return True
+        try:
+            if config.SEARCH_MODE == "index" and self.search_index.ready:
+                generation, docno = cursor[1:].split(":", 1)
+                return cursor[0] == "i" and int(generation) == self.search_index.generation and int(docno) >= -1
+            if config.SEARCH_MODE == "text":
+                return cursor[0] in "tp" and int(cursor[1:]) >= 0
+            downloads, _ = cursor.split(".", 1)
+            int(downloads)
+            return True
+        except (ValueError, IndexError):
+            return False
+    
+    async def search_page(self, query: str, after: Optional[str] = None, page_size: int = 5):
+        """Keyset-paginated search.
+        
+        Returns (books, next_cursor, estimated_total, total_capped). Only the
+        rows of the requested page are fetched; next_cursor is None on the last
+        page, estimated_total is None when it was not recomputed for a later
+        page and total_capped is True when it is only a lower bound. A cursor
+        from another search path restarts at the first page.
+        """
+        if not query:
+            return [], None, 0, False
+        
+        if not self.search_cursor_valid(after):
+            after = None
+        
+        cache_key = QueryCache.make_key(query, "page", after, page_size)
+        cached = self.search_cache.get(cache_key)
+        if cached is None:
+            try:
+                total = None
+                capped = False
+                if config.SEARCH_MODE == "index" and self.search_index.ready:
+                    # Continuation token is the last docno of the previous page; the count is exact
+                    after_docno = int(after.split(":", 1)[1]) if after else -1
+                    book_ids, next_docno, total = self.search_index.search_page(query, after_docno, page_size)
+                    next_cursor = f"i{self.search_index.generation}:{next_docno}" if next_docno is not None else None
+                elif config.SEARCH_MODE == "text":
+                    # Continuation token is the offset into the relevance ranking; 'p' marks
+                    # the prefix fallback chosen on the first page
+                    offset = int(after[1:]) if after else 0
+                    text_filter = {"$text": {"$search": query}}
+                    use_prefix = bool(after) and after[0] == "p"
+                    rows = []
+                    if not use_prefix:
+                        rows = await self.books.find(
+                            text_filter, {"_id": 0, "id": 1, "score": {"$meta": "textScore"}}
+                        ).sort([("score", {"$meta": "textScore"}), ("_id", 1)]).skip(offset).limit(
+                            page_size + 1).to_list(length=page_size + 1)
+                        use_prefix = not rows and after is None
+                    if use_prefix:
+                        rows = await self.books.find(
+                            self._prefix_filter(query), {"_id": 0, "id": 1}
+                        ).sort("_id", 1).skip(offset).limit(page_size + 1).to_list(length=page_size + 1)
+                    
+                    book_ids = [row["id"] for row in rows[:page_size]]
+                    kind = "p" if use_prefix else "t"
+                    next_cursor = f"{kind}{offset + page_size}" if len(rows) > page_size else None
+                    
+                    if after is None:
+                        count_filter = self._prefix_filter(query) if use_prefix else text_filter
+                        total = await self.books.count_documents(count_filter, limit=config.SEARCH_COUNT_LIMIT)
+                        capped = total >= config.SEARCH_COUNT_LIMIT
+                else:
+                    # Continuation token is the (downloads, id) of the previous page's last row
+                    search_filter = self._regex_filter(query)
+                    page_filter = search_filter
+                    if after:
+                        downloads, last_id = after.split(".", 1)
+                        downloads = int(downloads)
+                        page_filter = {"$and": [search_filter, {"$or": [
+                            {"downloads": {"$lt": downloads}},
+                            {"downloads": downloads, "id": {"$gt": last_id}}
+                        ]}]}
+                    
+                    rows = await self.books.find(
+                        page_filter, {"_id": 0, "id": 1, "downloads": 1}
+                    ).sort([("downloads", -1), ("id", 1)]).limit(page_size + 1).to_list(length=page_size + 1)
+                    
+                    book_ids = [row["id"] for row in rows[:page_size]]
+                    next_cursor = None
+                    if len(rows) > page_size:
+                        last = rows[page_size - 1]
+                        next_cursor = f"{last.get('downloads', 0)}.{last['id']}"
+                    
+                    if after is None:
+                        total = await self.books.count_documents(search_filter, limit=config.SEARCH_COUNT_LIMIT)
+                        capped = total >= config.SEARCH_COUNT_LIMIT
+            except Exception as e:
+                logger.error(f"❌ Search page error: {e}")
+                return [], None, 0, False
+            
+            cached = (tuple(book_ids), next_cursor, total, capped)
+            self.search_cache.set(cache_key, cached)
+        
+        book_ids, next_cursor, total, capped = cached
+        books = await self.get_books_by_ids(list(book_ids), "listing")
+        return books, next_cursor, total, capped
+    
+    async def _text_search_docs(self, query: str, limit: int, projection: Dict = None) -> List[Dict]:
+        """Search the text index ranked by relevance, falling back to a title/author prefix match"""
+        score = {"score": {"$meta": "textScore"}}
+        docs = await self.books.find(
+            {"$text": {"$search": query}}, {**(projection or {}), **score}
+        ).sort([("score", {"$meta": "textScore"})]).to_list(length=limit)
+        if docs:
+            return docs
+        
+        # Nothing matched whole words - try an anchored prefix query instead
+        return await self.books.find(self._prefix_filter(query), projection).to_list(length=limit)
+    
+    async def _regex_search_docs(self, query: str, limit: int, projection: Dict = None) -> List[Dict]:
+        """Unanchored case-insensitive scan across all searchable fields"""
+        return await self.books.find(self._regex_filter(query), projection).to_list(length=limit)
+    
+    async def get_books_by_ids(self, book_ids: List[str], view: str = "full") -> List[Book]:
+        """Fetch several books with one query, keeping the order of book_ids"""
+        if not book_ids:
+            return []
+        
+        try:
+            projection, hydrate = BOOK_VIEWS[view]
+            docs = {}
+            async for doc in self.books.find({"id": {"$in": list(book_ids)}}, projection):
+                docs[doc["id"]] = doc
+            
+            return [hydrate(docs[book_id]) for book_id in book_ids if book_id in docs]
+        except Exception as e:
+            logger.error(f"❌ Error getting books: {e}")
+            return []
+    
+    async def get_book(self, book_id: str, view: str = "full") -> Optional[Book]:
         """Get book by ID"""
         try:
-            doc = await self.books.find_one({"id": book_id})
+            projection, hydrate = BOOK_VIEWS[view]
+            doc = await self.books.find_one({"id": book_id}, projection)
             if doc:
-                return Book(
-                    id=doc.get("id", ""),
-                    title=doc.get("title", ""),
-                    author=doc.get("author", ""),
-                    file_id=doc.get("file_id", ""),
-                    file_type=doc.get("file_type", ""),
-                    file_size=doc.get("file_size", 0),
-                    file_name=doc.get("file_name", ""),
-                    category=doc.get("category", "General"),
-                    rating=doc.get("rating", 0.0),
-                    downloads=doc.get("downloads", 0),
-                    added_by=doc.get("added_by", 0),
-                    added_date=doc.get("added_date"),
-                    tags=doc.get("tags", [])
-                )
+                return hydrate(doc)
             return None
         except Exception as e:
             logger.error(f"❌ Error getting book: {e}")
             return None
     
     async def update_download_count(self, book_id: str):
-        """Increment download count for book"""
-        try:
-            await self.books.update_one(
-                {"id": book_id},
-                {"$inc": {"downloads": 1}}
-            )
-            await self.update_stats("total_downloads", 1)
-        except Exception as e:
-            logger.error(f"❌ Error updating download count: {e}")
+        """Increment download count for book (buffered)"""
+        self.counters.incr("books", {"id": book_id}, "downloads")
+        self.trending.record(book_id)
+        await self.update_stats("total_downloads", 1)
+    
+    async def update_user_download_count(self, user_id: int):
+        """Increment user download count (buffered)"""
+        self.counters.incr("users", {"id": user_id}, "downloads")
     
     async def get_or_create_user(self, user_id: int, username: str = "", first_name: str = "") -> User:
-        """Get user or create if not exists"""
+        """Get user or create if not exists, touching last_active in the same round trip"""
         try:
-            doc = await self.users.find_one({"id": user_id})
-            if doc:
-                user = User(
-                    id=doc.get("id", 0),
-                    username=doc.get("username", ""),
-                    first_name=doc.get("first_name", ""),
-                    last_name=doc.get("last_name", ""),
-                    joined_date=doc.get("joined_date"),
-                    searches=doc.get("searches", 0),
-                    downloads=doc.get("downloads", 0),
-                    is_premium=doc.get("is_premium", False),
-                    wishlist=doc.get("wishlist", []),
-                    last_active=datetime.now()
-                )
-                # Update last active
-                await self.users.update_one(
-                    {"id": user_id},
-                    {"$set": {"last_active": user.last_active}}
-                )
-                return user
-            
-            # Create new user
-            user = User(
-                id=user_id,
-                username=username,
-                first_name=first_name,
-                joined_date=datetime.now(),
-                last_active=datetime.now()
+            now = datetime.now()
+            new_user = User(id=user_id, username=username, first_name=first_name, joined_date=now, last_active=now)
+            new_fields = new_user.to_dict()
+            del new_fields["id"], new_fields["last_active"]
+            
+            # The pre-update document is None exactly when the upsert inserted
+            before = await self.users.find_one_and_update(
+                {"id": user_id},
+                {"$set": {"last_active": now, "blocked_at": None}, "$setOnInsert": new_fields},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
             )
-            await self.users.insert_one(user.to_dict())
-            await self.update_stats("total_users", 1)
-            logger.info(f"👤 New user created: {user_id}")
-            return user
+            if before is None:
+                await self.update_stats("total_users", 1)
+                logger.info(f"👤 New user created: {user_id}")
+                return new_user
+            
+            before.update(last_active=now, blocked_at=None)
+            return User.from_doc(before)
         except Exception as e:
             logger.error(f"❌ Error getting/creating user: {e}")
             # Return a dummy user if error occurs
             return User(id=user_id, username=username, first_name=first_name)
     
-    async def update_user_search_count(self, user_id: int):
-        """Increment user search count"""
+    # Users who blocked the bot or whose accounts are gone; push features skip them
+    REACHABLE_FILTER = {"blocked_at": None}
+    
+    async def mark_unreachable(self, user_id: int, reason: str):
+        """Record a permanent delivery failure; cleared again when the user next interacts"""
         try:
             await self.users.update_one(
                 {"id": user_id},
-                {"$inc": {"searches": 1}}
+                {"$set": {"blocked_at": datetime.now(), "blocked_reason": reason}}
             )
-            await self.update_stats("total_searches", 1)
         except Exception as e:
-            logger.error(f"❌ Error updating search count: {e}")
+            logger.error(f"❌ Error marking user unreachable: {e}")
     
-    async def update_stats(self, key: str, increment: int = 1):
-        """Update statistics"""
+    async def count_unreachable_users(self) -> int:
+        """Number of users skipped by push features"""
         try:
-            await self.stats.update_one(
-                {"key": key},
-                {"$inc": {"value": increment}},
-                upsert=True
-            )
+            return await self.users.count_documents({"blocked_at": {"$ne": None}})
+        except Exception as e:
+            logger.error(f"❌ Error counting unreachable users: {e}")
+            return 0
+    
+    async def get_user_overview(self) -> Dict:
+        """User counts and top downloaders for the admin user panel"""
+        try:
+            now = datetime.now()
+            return {
+                "total": await self.users.estimated_document_count(),
+                "active_24h": await self.users.count_documents({"last_active": {"$gte": now - timedelta(days=1)}}),
+                "new_7d": await self.users.count_documents({"joined_date": {"$gte": now - timedelta(days=7)}}),
+                "unreachable": await self.count_unreachable_users(),
+                "top": await self.users.find(
+                    {}, {"_id": 0, "id": 1, "username": 1, "first_name": 1, "downloads": 1}
+                ).sort("downloads", -1).limit(5).to_list(5),
+            }
         except Exception as e:
-            logger.error(f"❌ Error updating stats: {e}")
+            logger.error(f"❌ Error getting user overview: {e}")
+            return {}
+    
+    async def update_user_search_count(self, user_id: int):
+        """Increment user search count (buffered)"""
+        self.counters.incr("users", {"id": user_id}, "searches")
+        await self.update_stats("total_searches", 1)
+    
+    async def update_stats(self, key: str, increment: int = 1):
+        """Update statistics (buffered, flushed every COUNTER_FLUSH_INTERVAL seconds)"""
+        self.counters.incr("stats", {"key": key}, "value", increment, upsert=True)
     
     async def get_stats(self) -> Dict:
         """Get all statistics"""
         try:
             stats = {}
-            cursor = self.stats.find({})
+            cursor = self.stats.find({"key": {"$exists": True}})
             async for doc in cursor:
                 stats[doc["key"]] = doc.get("value", 0)
             return stats
@@ -325,33 +1506,38 @@ class Database:
             logger.error(f"❌ Error getting stats: {e}")
             return {}
     
-    async def get_trending_books(self, limit: int = 10) -> List[Book]:
-        """Get trending books based on downloads"""
+    async def get_trending_books(self, limit: int = 10, view: str = "listing") -> List[Book]:
+        """Get trending books from the decayed leaderboard, or all-time downloads before any activity"""
         try:
-            cursor = self.books.find().sort("downloads", -1).limit(limit)
-            results = []
-            async for doc in cursor:
-                book = Book(
-                    id=doc.get("id", ""),
-                    title=doc.get("title", ""),
-                    author=doc.get("author", ""),
-                    file_id=doc.get("file_id", ""),
-                    file_type=doc.get("file_type", ""),
-                    file_size=doc.get("file_size", 0),
-                    file_name=doc.get("file_name", ""),
-                    category=doc.get("category", "General"),
-                    rating=doc.get("rating", 0.0),
-                    downloads=doc.get("downloads", 0),
-                    added_by=doc.get("added_by", 0),
-                    added_date=doc.get("added_date"),
-                    tags=doc.get("tags", [])
-                )
-                results.append(book)
-            return results
+            leaderboard = self.trending.leaderboard[:limit]
+            if leaderboard:
+                return await self.get_books_by_ids([book_id for book_id, _, _ in leaderboard], view)
+            
+            projection, hydrate = BOOK_VIEWS[view]
+            cursor = self.books.find({}, projection).sort("downloads", -1).limit(limit)
+            return [hydrate(doc) async for doc in cursor]
         except Exception as e:
             logger.error(f"❌ Error getting trending books: {e}")
             return []
     
+    async def get_random_book(self, category: Optional[str] = None, prefix: bool = False) -> Optional[BookSummary]:
+        """Pick one random book (optionally within a category, or a category key prefix) with $sample"""
+        try:
+            pipeline = []
+            if category:
+                key = Book.category_key(category)
+                # Case-sensitive anchored prefixes still use the category_key index
+                match = {"$regex": f"^{re.escape(key)}"} if prefix else key
+                pipeline.append({"$match": {"category_key": match}})
+            pipeline.append({"$sample": {"size": 1}})
+            pipeline.append({"$project": LISTING_PROJECTION})
+            
+            docs = await self.books.aggregate(pipeline).to_list(length=1)
+            return BookSummary.from_doc(docs[0]) if docs else None
+        except Exception as e:
+            logger.error(f"❌ Error getting random book: {e}")
+            return None
+    
     async def add_to_wishlist(self, user_id: int, book_id: str):
         """Add book to user's wishlist"""
         try:
@@ -373,19 +1559,27 @@ class Database:
             logger.error(f"❌ Error removing from wishlist: {e}")
     
     async def get_user_wishlist(self, user_id: int) -> List[Book]:
-        """Get user's wishlisted books"""
+        """Get user's wishlisted books, pruning ids of books that no longer exist"""
         try:
-            user = await self.users.find_one({"id": user_id})
+            user = await self.users.find_one({"id": user_id}, {"_id": 0, "wishlist": 1})
             if not user or not user.get("wishlist"):
                 return []
             
-            books = []
-            for book_id in user.get("wishlist", []):
-                book = await self.get_book(book_id)
-                if book:
-                    books.append(book)
+            wishlist = user["wishlist"]
+            projection, hydrate = BOOK_VIEWS["listing"]
+            docs = {}
+            async for doc in self.books.find({"id": {"$in": wishlist}}, projection):
+                docs[doc["id"]] = doc
             
-            return books
+            stale_ids = [book_id for book_id in wishlist if book_id not in docs]
+            if stale_ids:
+                await self.users.update_one(
+                    {"id": user_id},
+                    {"$pullAll": {"wishlist": stale_ids}}
+                )
+                logger.info(f"🧹 Pruned {len(stale_ids)} stale wishlist entries for user {user_id}")
+            
+            return [hydrate(docs[book_id]) for book_id in wishlist if book_id in docs]
         except Exception as e:
             logger.error(f"❌ Error getting wishlist: {e}")
             return []
@@ -401,6 +1595,13 @@ class ReactionSystem:
             'video': ['🎥', '📹', '🎬'],
             'owner': ['💎', '👑', '⚙️'],
         }
+        self._pending: Set[asyncio.Task] = set()  # reactions in flight, referenced until they finish
+    
+    def react(self, client: Client, chat_id: int, message_id: int, msg_type: str = 'text'):
+        """Fire-and-forget add_reaction; handlers must not wait on the background lane"""
+        task = asyncio.create_task(self.add_reaction(client, chat_id, message_id, msg_type))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
     
     async def add_reaction(self, client: Client, chat_id: int, message_id: int, msg_type: str = 'text'):
         """Add random reaction to message based on type"""
@@ -411,30 +1612,280 @@ class ReactionSystem:
         reaction = random.choice(reactions)
         
         try:
-            await client.send_reaction(chat_id, message_id, reaction)
+            await outbound.call(outbound.BACKGROUND, None, client.send_reaction, chat_id, message_id, reaction)
         except Exception as e:
             logger.debug(f"Could not add reaction: {e}")
 
+# ========== DELETION SCHEDULER ==========
+class DeletionScheduler:
+    """Single-task timer heap for delayed message deletions.
+    
+    Deadlines live in a min-heap keyed by wall-clock time and are mirrored in
+    the `pending_deletions` collection so they survive restarts. Cancelling
+    is O(1): the heap entry is left behind and skipped when it surfaces.
+    """
+    
+    def __init__(self, on_deleted=None):
+        self.on_deleted = on_deleted  # called with (chat_id, message_id) after deletion
+        self._heap: List[tuple] = []  # (due, seq, chat_id, message_id)
+        self._due: Dict[tuple, float] = {}  # (chat_id, message_id) -> due
+        self._seq = 0
+        self._wakeup = asyncio.Event()
+    
+    @property
+    def collection(self):
+        return db.db.pending_deletions
+    
+    def __len__(self):
+        return len(self._due)
+    
+    def _push(self, chat_id: int, message_id: int, due: float):
+        self._seq += 1
+        self._due[(chat_id, message_id)] = due
+        heapq.heappush(self._heap, (due, self._seq, chat_id, message_id))
+        if self._heap[0][1] == self._seq:
+            self._wakeup.set()  # new earliest deadline
+    
+    async def schedule(self, chat_id: int, message_id: int, delay: float):
+        """Delete a message after `delay` seconds"""
+        due = time.time() + delay
+        self._push(chat_id, message_id, due)
+        try:
+            await self.collection.update_one(
+                {"chat_id": chat_id, "message_id": message_id},
+                {"$set": {"due": datetime.fromtimestamp(due, timezone.utc)}},
+                upsert=True
+            )
+        except Exception as e:
+            logger.error(f"Failed to persist deletion: {e}")
+    
+    async def cancel(self, chat_id: int, message_id: int):
+        """Forget a pending deletion"""
+        if self._due.pop((chat_id, message_id), None) is None:
+            return
+        
+        # Rebuild once stale entries dominate the heap
+        if len(self._heap) > 2 * len(self._due) + 64:
+            self._heap = [entry for entry in self._heap if self._due.get((entry[2], entry[3])) == entry[0]]
+            heapq.heapify(self._heap)
+        
+        try:
+            await self.collection.delete_one({"chat_id": chat_id, "message_id": message_id})
+        except Exception as e:
+            logger.error(f"Failed to remove persisted deletion: {e}")
+    
+    async def load(self):
+        """Restore deletions persisted before a restart"""
+        async for doc in self.collection.find({}, {"_id": 0}):
+            # Naive datetimes from the driver are UTC
+            due = doc["due"].replace(tzinfo=timezone.utc)
+            self._push(doc["chat_id"], doc["message_id"], due.timestamp())
+        if self._due:
+            logger.info(f"🗑️ Restored {len(self._due)} pending deletions")
+    
+    def _pop_due(self, now: float) -> Dict[int, List[int]]:
+        """Pop every live entry whose deadline has passed, grouped by chat"""
+        due_by_chat: Dict[int, List[int]] = {}
+        while self._heap and self._heap[0][0] <= now:
+            due, _, chat_id, message_id = heapq.heappop(self._heap)
+            if self._due.get((chat_id, message_id)) != due:
+                continue  # cancelled or rescheduled
+            del self._due[(chat_id, message_id)]
+            due_by_chat.setdefault(chat_id, []).append(message_id)
+        return due_by_chat
+    
+    async def run(self):
+        """Sleep until the earliest deadline, delete what is due, repeat"""
+        while True:
+            self._wakeup.clear()
+            timeout = None
+            if self._heap:
+                timeout = max(0.0, self._heap[0][0] - time.time())
+            
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                    continue
+                except asyncio.TimeoutError:
+                    pass
+            
+            for chat_id, message_ids in self._pop_due(time.time()).items():
+                try:
+                    await outbound.call(outbound.BACKGROUND, None, app.delete_messages, chat_id, message_ids)
+                    logger.info(f"Auto-deleted {len(message_ids)} message(s) in chat {chat_id}")
+                except Exception as e:
+                    logger.error(f"Failed to auto-delete: {e}")
+                
+                try:
+                    await self.collection.delete_many({"chat_id": chat_id, "message_id": {"$in": message_ids}})
+                except Exception as e:
+                    logger.error(f"Failed to remove persisted deletions: {e}")
+                
+                if self.on_deleted:
+                    for message_id in message_ids:
+                        self.on_deleted(chat_id, message_id)
+
+# ========== SESSION STORE ==========
+class SessionStore:
+    """Bounded mapping with a sliding TTL and O(1) LRU eviction.
+    
+    Every get or set moves the key to the end and pushes its expiry out,
+    so insertion order is also expiry order and purging stops at the first
+    live entry.
+    """
+    
+    def __init__(self, max_entries: int = 50000, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self.evictions = 0
+        self.expirations = 0
+    
+    def __len__(self):
+        return len(self._data)
+    
+    def __contains__(self, key):
+        """Read-only check: unlike get(), it does not refresh the TTL or LRU position"""
+        entry = self._data.get(key)
+        return entry is not None and entry[0] >= time.monotonic()
+    
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        
+        now = time.monotonic()
+        if entry[0] < now:
+            del self._data[key]
+            self.expirations += 1
+            return default
+        
+        self._data[key] = (now + self.ttl, entry[1])
+        self._data.move_to_end(key)
+        return entry[1]
+    
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+    
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+    
+    def purge_expired(self) -> int:
+        """Drop expired entries from the front; returns how many were removed"""
+        now = time.monotonic()
+        removed = 0
+        while self._data:
+            key, (expires_at, _) = next(iter(self._data.items()))
+            if expires_at >= now:
+                break
+            del self._data[key]
+            removed += 1
+        self.expirations += removed
+        return removed
+    
+    def approx_bytes(self) -> int:
+        """Shallow memory estimate of the store and its values"""
+        total = sys.getsizeof(self._data)
+        for key, (_, value) in self._data.items():
+            total += sys.getsizeof(key) + sys.getsizeof(value)
+            if isinstance(value, ActiveSearch):
+                total += sys.getsizeof(value.book_ids)
+            elif isinstance(value, dict):
+                total += sum(sys.getsizeof(item) for item in value.values())
+        return total
+    
+    def stats(self) -> Dict:
+        return {
+            "size": len(self._data),
+            "max_entries": self.max_entries,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "approx_bytes": self.approx_bytes()
+        }
+
+class ActiveSearch:
+    """Compact record of a user's latest search message"""
+    
+    __slots__ = ("message_id", "book_ids")
+    
+    def __init__(self, message_id: int, book_ids: List[str]):
+        self.message_id = message_id
+        self.book_ids = ",".join(book_ids)  # one string instead of a list of strings
+    
+    @property
+    def books(self) -> List[str]:
+        return self.book_ids.split(",") if self.book_ids else []
+
 # ========== SEARCH MANAGER ==========
 class SearchManager:
     def __init__(self):
-        self.active_searches = {}
+        self.active_searches = SessionStore(config.SESSION_MAX_ENTRIES, config.SESSION_TTL)
+        self.result_sets = SessionStore(config.SESSION_MAX_ENTRIES, config.SESSION_TTL)
+        self.deletions = DeletionScheduler(on_deleted=self._on_deleted)
+        self._deletes: Set[asyncio.Task] = set()  # immediate deletes in flight
     
-    async def format_search_results(self, books: List[Book], page: int = 1, per_page: int = 5) -> str:
-        """Format search results with pagination"""
-        if not books:
-            return "❌ No books found."
+    def create_result_set(self, user_id: int, query: str) -> str:
+        """Keep a search's continuation cursors under a short token for pagination"""
+        token = uuid.uuid4().hex[:8]
+        self.result_sets.set(token, {
+            'user_id': user_id,
+            'query': query,
+            'cursors': [None],  # cursors[n] starts page n + 1
+            'total': 0,
+            'capped': False  # total is only a lower bound
+        })
+        return token
+    
+    async def render_page(self, token: str, page: int = 1, per_page: int = 5):
+        """Render one page of a stored result set, fetching only that page's books.
         
-        start_idx = (page - 1) * per_page
-        end_idx = start_idx + per_page
-        page_books = books[start_idx:end_idx]
+        Returns (text, keyboard, page_books); text is None when the result set
+        expired or the page was never reached.
+        """
+        result_set = self.result_sets.get(token)
+        if not result_set or not 1 <= page <= len(result_set['cursors']):
+            return None, None, []
+        
+        cursors = result_set['cursors']
+        if not db.search_cursor_valid(cursors[page - 1]):
+            # The search path changed under this result set (e.g. the index finished building)
+            del cursors[1:]
+            page = 1
+        
+        page_books, next_cursor, total, capped = await db.search_page(
+            result_set['query'], cursors[page - 1], per_page
+        )
+        if total is not None:
+            result_set['total'] = total
+            result_set['capped'] = capped
+        if next_cursor and len(cursors) == page:
+            cursors.append(next_cursor)
+        
+        text = await self.format_search_results(
+            page_books, result_set['total'], page, per_page, capped=result_set['capped']
+        )
+        keyboard = await self.create_search_keyboard(page_books, token, page, per_page, has_next=bool(next_cursor))
+        return text, keyboard, page_books
+    
+    async def format_search_results(self, page_books: List[Book], total: int, page: int = 1, per_page: int = 5,
+                                    capped: bool = False) -> str:
+        """Format one page of search results"""
+        if not total:
+            return "❌ No books found."
         
         if not page_books:
             return "❌ No more results on this page."
         
-        total_pages = max(1, (len(books) + per_page - 1) // per_page)
+        start_idx = (page - 1) * per_page
+        total_pages = max(page, (total + per_page - 1) // per_page)
+        more = "+" if capped else ""
         
-        header = f"🔍 **SEARCH RESULTS** (Page {page}/{total_pages})\n"
+        header = f"🔍 **SEARCH RESULTS** (Page {page}/{total_pages}{more})\n"
         header += "─" * 40 + "\n\n"
         
         results = []
@@ -450,18 +1901,15 @@ class SearchManager:
             
             results.append(book_text)
         
-        footer = f"\n📚 **Found {len(books)} books**"
+        footer = f"\n📚 **Found {total:,}{more} books**"
         footer += "\n⚠️ *Note: Search results auto-delete after selection*"
         
         return header + "\n".join(results) + footer
     
-    async def create_search_keyboard(self, books: List[Book], page: int = 1, per_page: int = 5) -> InlineKeyboardMarkup:
-        """Create paginated keyboard for search results"""
+    async def create_search_keyboard(self, page_books: List[Book], token: str, page: int = 1,
+                                     per_page: int = 5, has_next: bool = False) -> InlineKeyboardMarkup:
+        """Create paginated keyboard for one page of search results"""
         start_idx = (page - 1) * per_page
-        end_idx = start_idx + per_page
-        page_books = books[start_idx:end_idx]
-        
-        total_pages = max(1, (len(books) + per_page - 1) // per_page)
         
         keyboard = []
         
@@ -473,57 +1921,165 @@ class SearchManager:
         # Navigation row
         nav_buttons = []
         if page > 1:
-            nav_buttons.append(InlineKeyboardButton("⬅️ Previous", callback_data=f"prev_{page-1}"))
+            nav_buttons.append(InlineKeyboardButton("⬅️ Previous", callback_data=f"prev_{token}_{page-1}"))
         
         nav_buttons.append(InlineKeyboardButton("🗑️ Clear", callback_data="clear_search"))
         
-        if page < total_pages:
-            nav_buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"next_{page+1}"))
+        if has_next:
+            nav_buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"next_{token}_{page+1}"))
         
         if nav_buttons:
             keyboard.append(nav_buttons)
         
         return InlineKeyboardMarkup(keyboard)
     
-    async def store_search(self, user_id: int, message_id: int, books: List[Book]):
-        """Store search results for auto-deletion"""
-        self.active_searches[user_id] = {
-            'message_id': message_id,
-            'books': [book.id for book in books],
-            'timestamp': datetime.now()
-        }
-        
-        # Start auto-delete timer (10 minutes)
-        asyncio.create_task(self.auto_delete_search(user_id, message_id))
+    async def store_search(self, user_id: int, message_id: int, book_ids: List[str]):
+        """Store search results and schedule their auto-deletion"""
+        self.active_searches.set(user_id, ActiveSearch(message_id, book_ids))
+        
+        await self.deletions.schedule(user_id, message_id, config.AUTO_DELETE_DELAY)
+    
+    def _on_deleted(self, chat_id: int, message_id: int):
+        """Drop the active search if it is the message that was just deleted"""
+        search = self.active_searches.get(chat_id)
+        if search and search.message_id == message_id:
+            self.active_searches.pop(chat_id)
+    
+    def purge_expired(self) -> int:
+        """Drop expired sessions and result sets"""
+        return self.active_searches.purge_expired() + self.result_sets.purge_expired()
+    
+    async def discard_search(self, user_id: int, message_id: int):
+        """Forget a search whose message was removed some other way"""
+        await self.deletions.cancel(user_id, message_id)
+        self._on_deleted(user_id, message_id)
+    
+    async def delete_search_immediately(self, user_id: int) -> Optional[int]:
+        """Delete search results without waiting on the background lane; returns the message id"""
+        search = self.active_searches.pop(user_id, None)
+        if search:
+            await self.deletions.cancel(user_id, search.message_id)
+            task = asyncio.create_task(self._delete(user_id, search.message_id))
+            self._deletes.add(task)
+            task.add_done_callback(self._deletes.discard)
+            return search.message_id
+        return None
+    
+    async def _delete(self, chat_id: int, message_id: int):
+        try:
+            await outbound.call(outbound.BACKGROUND, None, app.delete_messages, chat_id, message_id)
+        except:
+            pass
+
+# ========== FILE PROCESSOR ==========
+class KeywordMatcher:
+    """Aho-Corasick automaton that finds every keyword in one pass over the text.
+    
+    A match must start at a word boundary. Keywords of SHORT_KEYWORD_LEN
+    characters or fewer must also end at one, so 'ai' no longer matches
+    inside 'rain' while stems like 'cook' still match 'cooking'.
+    """
+    
+    SHORT_KEYWORD_LEN = 3
     
-    async def auto_delete_search(self, user_id: int, message_id: int):
-        """Auto-delete search results after 10 minutes"""
-        await asyncio.sleep(600)  # 10 minutes
+    def __init__(self, keywords: Iterable[str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[tuple]] = [[]]  # state -> [(priority, length)]
         
-        if user_id in self.active_searches:
-            try:
-                await app.delete_messages(user_id, message_id)
-                del self.active_searches[user_id]
-                logger.info(f"Auto-deleted search results for user {user_id}")
-            except Exception as e:
-                logger.error(f"Failed to auto-delete: {e}")
+        for priority, keyword in enumerate(keywords):
+            state = 0
+            for ch in keyword:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = nxt
+            self._out[state].append((priority, len(keyword)))
+        
+        # Breadth-first failure links; outputs inherit those of their fallback state
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[nxt] = self._goto[fallback].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
     
-    async def delete_search_immediately(self, user_id: int):
-        """Delete search results immediately"""
-        if user_id in self.active_searches:
-            try:
-                await app.delete_messages(user_id, self.active_searches[user_id]['message_id'])
-                del self.active_searches[user_id]
-            except:
-                pass
+    def first(self, text: str) -> int:
+        """Lowest priority index of any keyword found in text, or -1"""
+        goto, fail, out = self._goto, self._fail, self._out
+        best = -1
+        state = 0
+        last = len(text) - 1
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for priority, length in out[state]:
+                if best != -1 and priority >= best:
+                    continue
+                start = i - length + 1
+                if start > 0 and text[start - 1].isalnum():
+                    continue
+                if length <= self.SHORT_KEYWORD_LEN and i < last and text[i + 1].isalnum():
+                    continue
+                best = priority
+        return best
+
+# Keyword -> category; earlier entries win when several keywords match
+CATEGORY_KEYWORDS = {
+    'python': 'Programming',
+    'java': 'Programming',
+    'javascript': 'Programming',
+    'c++': 'Programming',
+    'html': 'Programming',
+    'css': 'Programming',
+    'machine learning': 'AI & ML',
+    'ai': 'AI & ML',
+    'artificial intelligence': 'AI & ML',
+    'data science': 'Data Science',
+    'data analysis': 'Data Science',
+    'business': 'Business',
+    'finance': 'Finance',
+    'marketing': 'Marketing',
+    'history': 'History',
+    'science': 'Science',
+    'math': 'Mathematics',
+    'physics': 'Science',
+    'chemistry': 'Science',
+    'novel': 'Fiction',
+    'fiction': 'Fiction',
+    'story': 'Fiction',
+    'cook': 'Cooking',
+    'recipe': 'Cooking'
+}
 
-# ========== FILE PROCESSOR ==========
 class FileProcessor:
+    # Applied with match(): a leading lazy group can always start at 0, and
+    # anchoring avoids retrying the whole pattern from every offset
+    AUTHOR_PATTERNS = [
+        re.compile(r'(.+?)\s+by\s+(.+)', re.IGNORECASE),  # Title by Author
+        re.compile(r'(.+?)\s+-\s+(.+)'),                  # Author - Title
+        re.compile(r'(.+?)\s+–\s+(.+)'),                  # Author – Title (en dash)
+        re.compile(r'(.+?)\s*\((.*?)\)'),                  # Title (Author)
+    ]
+    YEAR_PATTERN = re.compile(r'\((\d{4})\)')
+    YEAR_STRIP_PATTERN = re.compile(r'\(\d{4}\)')
+    BRACKETS_PATTERN = re.compile(r'[\[\](){}]')
+    UNSAFE_CHARS_PATTERN = re.compile(r'[^\w\s\.\-]')
+    SPACES_PATTERN = re.compile(r'\s+')
+    CATEGORY_LIST = list(CATEGORY_KEYWORDS.values())
+    CATEGORY_MATCHER = KeywordMatcher(CATEGORY_KEYWORDS)
+    
     @staticmethod
-    async def extract_metadata(filename: str) -> Dict:
-        """Extract metadata from filename"""
-        import re
-        
+    def extract_metadata_sync(filename: str) -> Dict:
+        """Extract metadata from filename (no I/O, safe to call in tight loops)"""
         metadata = {
             'title': filename.rsplit('.', 1)[0],
             'author': 'Unknown',
@@ -532,159 +2088,985 @@ class FileProcessor:
         }
         
         # Try to extract author
-        patterns = [
-            r'(.+?)\s+by\s+(.+)',  # Title by Author
-            r'(.+?)\s+-\s+(.+)',   # Author - Title
-            r'(.+?)\s+–\s+(.+)',   # Author – Title (en dash)
-            r'(.+?)\s*\((.*?)\)',  # Title (Author)
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, metadata['title'], re.IGNORECASE)
+        for pattern in FileProcessor.AUTHOR_PATTERNS:
+            match = pattern.match(metadata['title'])
             if match:
                 metadata['title'] = match.group(1).strip()
-                if pattern.startswith(r'(.+?)\s+by'):
-                    metadata['author'] = match.group(2).strip()
-                else:
-                    metadata['author'] = match.group(2).strip()
+                metadata['author'] = match.group(2).strip()
                 break
         
         # Extract year
-        match = re.search(r'\((\d{4})\)', metadata['title'])
+        match = FileProcessor.YEAR_PATTERN.search(metadata['title'])
         if match:
             metadata['year'] = match.group(1)
-            metadata['title'] = re.sub(r'\(\d{4}\)', '', metadata['title']).strip()
+            metadata['title'] = FileProcessor.YEAR_STRIP_PATTERN.sub('', metadata['title']).strip()
         
         # Clean title
-        metadata['title'] = re.sub(r'[\[\](){}]', '', metadata['title']).strip()
+        metadata['title'] = FileProcessor.BRACKETS_PATTERN.sub('', metadata['title']).strip()
         
         # Determine category from keywords
-        title_lower = metadata['title'].lower()
-        category_map = {
-            'python': 'Programming',
-            'java': 'Programming', 
-            'javascript': 'Programming',
-            'c++': 'Programming',
-            'html': 'Programming',
-            'css': 'Programming',
-            'machine learning': 'AI & ML',
-            'ai': 'AI & ML',
-            'artificial intelligence': 'AI & ML',
-            'data science': 'Data Science',
-            'data analysis': 'Data Science',
-            'business': 'Business',
-            'finance': 'Finance',
-            'marketing': 'Marketing',
-            'history': 'History',
-            'science': 'Science',
-            'math': 'Mathematics',
-            'physics': 'Science',
-            'chemistry': 'Science',
-            'novel': 'Fiction',
-            'fiction': 'Fiction',
-            'story': 'Fiction',
-            'cook': 'Cooking',
-            'recipe': 'Cooking'
-        }
-        
-        for keyword, category in category_map.items():
-            if keyword in title_lower:
-                metadata['category'] = category
-                break
+        found = FileProcessor.CATEGORY_MATCHER.first(metadata['title'].lower())
+        if found != -1:
+            metadata['category'] = FileProcessor.CATEGORY_LIST[found]
         
         return metadata
     
     @staticmethod
-    async def clean_filename(filename: str) -> str:
+    def extract_metadata_batch(filenames: Iterable[str]) -> List[Dict]:
+        """Extract metadata for many filenames at once (bulk ingestion, reindex)"""
+        extract = FileProcessor.extract_metadata_sync
+        return [extract(filename) for filename in filenames]
+    
+    @staticmethod
+    async def extract_metadata(filename: str) -> Dict:
+        """Extract metadata from filename"""
+        return FileProcessor.extract_metadata_sync(filename)
+    
+    @staticmethod
+    def build_book(file_name: str, file_size: int, message_id: int, added_by: int,
+                   metadata: Dict, clean_name: str) -> Book:
+        """Create a Book for a document stored in the database channel"""
+        return Book(
+            id=str(uuid.uuid4())[:8].upper(),
+            title=metadata['title'],
+            author=metadata['author'],
+            file_id=str(message_id),
+            file_type=file_name.split('.')[-1].upper() if '.' in file_name else "PDF",
+            file_size=file_size,
+            file_name=clean_name,
+            category=metadata['category'],
+            added_by=added_by
+        )
+    
+    @staticmethod
+    def clean_filename_sync(filename: str) -> str:
         """Clean filename by removing special characters"""
-        import re
         # Remove special characters but keep spaces and dots
-        cleaned = re.sub(r'[^\w\s\.\-]', '', filename)
+        cleaned = FileProcessor.UNSAFE_CHARS_PATTERN.sub('', filename)
         # Replace multiple spaces with single space
-        cleaned = re.sub(r'\s+', ' ', cleaned)
+        cleaned = FileProcessor.SPACES_PATTERN.sub(' ', cleaned)
         return cleaned.strip()
+    
+    @staticmethod
+    async def clean_filename(filename: str) -> str:
+        """Clean filename by removing special characters"""
+        return FileProcessor.clean_filename_sync(filename)
+
+# ========== INGESTION PIPELINE ==========
+class IngestBatch:
+    """One burst of admin uploads in a chat, reported through one summary message"""
+    
+    def __init__(self, chat_id: int, reply_to: int):
+        self.chat_id = chat_id
+        self.reply_to = reply_to
+        self.summary_msg = None
+        self.received = 0
+        self.saved = 0
+        self.failed = 0
+        self.duplicates = 0
+        self.pending = 0
+        self.titles: List[str] = []
+        self.errors: List[str] = []
+        self.started = time.monotonic()
+        self.last_activity = time.monotonic()
+    
+    def render(self, final: bool = False) -> str:
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        header = "✅ **UPLOAD BATCH COMPLETE**" if final else "📦 **Processing uploads...**"
+        text = f"{header}\n\n"
+        text += f"📥 Received: {self.received}\n"
+        text += f"📚 Added: {self.saved} | ♻️ Duplicates: {self.duplicates} | ❌ Failed: {self.failed} | ⏳ Pending: {self.pending}\n"
+        text += f"⚡ {self.saved / elapsed:.1f} books/s\n"
+        if self.titles:
+            text += "\n" + "\n".join(f"• {title}" for title in self.titles[-10:])
+            if self.saved > 10:
+                text += f"\n… and {self.saved - 10} more"
+        if self.errors:
+            text += "\n\n⚠️ " + "\n⚠️ ".join(self.errors[-3:])
+        return text
+
+class IngestionPipeline:
+    """Queue + worker pool for admin uploads with batched inserts.
+    
+    Workers forward documents to the database channel (the Telegram-bound
+    step); a writer flushes the resulting books with insert_many. Uploads
+    from one chat that arrive close together (including whole media groups)
+    share a single, throttled summary message.
+    """
+    
+    def __init__(self, workers: int = 4, insert_batch: int = 100,
+                 progress_interval: float = 3, batch_idle: float = 10):
+        self.workers = workers
+        self.insert_batch = insert_batch
+        self.progress_interval = progress_interval
+        self.batch_idle = batch_idle
+        self.queue = asyncio.Queue()
+        self._batches: Dict[int, IngestBatch] = {}  # chat_id -> open batch
+        self._buffer: List[tuple] = []  # (batch, book)
+        self._in_flight: Set[str] = set()  # file_unique_ids accepted but not yet inserted
+        self._flush_lock = asyncio.Lock()
+        self._tasks: List[asyncio.Task] = []
+        self._reports: Set[asyncio.Task] = set()  # batch summaries, referenced until they finish
+    
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._flusher()))
+    
+    async def stop(self, drain_timeout: float = 30):
+        """Finish queued uploads (for up to drain_timeout), write the buffer and report leftovers"""
+        try:
+            await asyncio.wait_for(self.queue.join(), drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Upload queue not drained after {drain_timeout:.0f}s")
+        
+        # Cancel under the flush lock so no task is cut off between swapping the buffer and inserting it
+        async with self._flush_lock:
+            for task in self._tasks:
+                task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.flush()
+        
+        queued = []
+        while not self.queue.empty():
+            _, message = self.queue.get_nowait()
+            queued.append(message.document.file_name or "file")
+        unfinished = sum(batch.pending for batch in self._batches.values())
+        if not unfinished:
+            return
+        
+        logger.error(f"❌ Shutdown left {unfinished} uploads unsaved ({len(queued)} still queued)")
+        if config.OWNER_ID:
+            text = f"⚠️ **Shutdown interrupted {unfinished} uploads.** Please upload them again:\n"
+            text += "\n".join(f"• {name[:50]}" for name in queued[:20])
+            if unfinished > len(queued):
+                text += f"\n• {unfinished - len(queued)} that were being forwarded (check the database channel)"
+            try:
+                await outbound.call(outbound.BACKGROUND, None, app.send_message, config.OWNER_ID, text)
+            except Exception as e:
+                logger.error(f"Could not report unsaved uploads: {e}")
+    
+    def submit(self, message: Message) -> IngestBatch:
+        """Queue an uploaded document, joining the chat's open batch"""
+        batch = self._batches.get(message.chat.id)
+        if batch is None:
+            batch = IngestBatch(message.chat.id, message.id)
+            self._batches[message.chat.id] = batch
+            report = asyncio.create_task(self._report(batch))
+            self._reports.add(report)
+            report.add_done_callback(self._reports.discard)
+        
+        batch.received += 1
+        batch.pending += 1
+        batch.last_activity = time.monotonic()
+        self.queue.put_nowait((batch, message))
+        return batch
+    
+    async def _worker(self):
+        while True:
+            batch, message = await self.queue.get()
+            unique_id = message.document.file_unique_id
+            claimed = False
+            try:
+                file = message.document
+                file_name = file.file_name or "Unknown"
+                
+                # Skip re-uploads before they reach the channel; claim the id before
+                # awaiting so two workers cannot both pass the check
+                if unique_id in self._in_flight:
+                    batch.duplicates += 1
+                    batch.pending -= 1
+                    batch.errors.append(f"{file_name[:30]}: uploaded twice in this batch")
+                    continue
+                if unique_id:
+                    self._in_flight.add(unique_id)
+                    claimed = True
+                existing = await db.find_book_by_unique_id(unique_id)
+                if existing:
+                    self._in_flight.discard(unique_id)
+                    batch.duplicates += 1
+                    batch.pending -= 1
+                    batch.errors.append(f"{file_name[:30]}: already in library as `{existing['id']}`")
+                    continue
+                
+                metadata = file_processor.extract_metadata_sync(file_name)
+                clean_name = file_processor.clean_filename_sync(file_name)
+                
+                forwarded = await outbound.call(
+                    outbound.BULK, config.DATABASE_CHANNEL_ID, message.forward, config.DATABASE_CHANNEL_ID
+                )
+                book = file_processor.build_book(
+                    file_name, file.file_size, forwarded.id, message.from_user.id, metadata, clean_name
+                )
+                book.file_unique_id = file.file_unique_id
+                self._buffer.append((batch, book))
+                if len(self._buffer) >= self.insert_batch:
+                    await self.flush()
+            except Exception as e:
+                logger.error(f"Upload error: {e}")
+                if claimed:
+                    self._in_flight.discard(unique_id)
+                batch.failed += 1
+                batch.pending -= 1
+                batch.errors.append(f"{(message.document.file_name or 'file')[:30]}: {str(e)[:80]}")
+            finally:
+                self.queue.task_done()
+    
+    async def flush(self):
+        """Insert buffered books with one insert_many"""
+        async with self._flush_lock:
+            if not self._buffer:
+                return
+            pending, self._buffer = self._buffer, []
+            
+            inserted = await db.add_books([book for _, book in pending])
+            for batch, book in pending:
+                self._in_flight.discard(book.file_unique_id)
+                batch.pending -= 1
+                if book.id in inserted:
+                    batch.saved += 1
+                    batch.titles.append(f"{book.title[:40]} `{book.id}`")
+                else:
+                    batch.failed += 1
+                    batch.errors.append(f"{book.title[:30]}: not saved")
+    
+    async def _flusher(self):
+        while True:
+            await asyncio.sleep(1)
+            await self.flush()
+    
+    async def _report(self, batch: IngestBatch):
+        """Edit the batch summary at a throttled rate, then finalize it once idle"""
+        try:
+            batch.summary_msg = await outbound.call(
+                outbound.EDIT, None, app.send_message,
+                batch.chat_id, batch.render(), reply_to_message_id=batch.reply_to
+            )
+            last_text = None
+            while True:
+                await asyncio.sleep(self.progress_interval)
+                done = batch.pending == 0 and time.monotonic() - batch.last_activity >= self.batch_idle
+                if done and self._batches.get(batch.chat_id) is batch:
+                    del self._batches[batch.chat_id]
+                
+                text = batch.render(final=done)
+                if text != last_text:
+                    try:
+                        await outbound.call(outbound.EDIT, None, batch.summary_msg.edit_text, text)
+                        last_text = text
+                    except Exception:
+                        pass
+                if done:
+                    logger.info(f"Upload batch in chat {batch.chat_id}: {batch.saved} added, {batch.failed} failed")
+                    return
+        except Exception as e:
+            logger.error(f"Upload batch report error: {e}")
+            self._batches.pop(batch.chat_id, None)
+
+# ========== RATE LIMITING ==========
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, bursts up to `capacity`"""
+    
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = asyncio.Lock()
+    
+    def pause(self, seconds: float):
+        """Block every caller for `seconds` (used when Telegram answers FloodWait)"""
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+    
+    async def acquire(self, tokens: float = 1.0):
+        """Wait until `tokens` are available and take them"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._blocked_until:
+                    await asyncio.sleep(self._blocked_until - now)
+                    continue
+                
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+class ChatRateLimiter:
+    """Minimum interval between requests to the same chat.
+    
+    Each caller reserves the next free slot for its chat before sleeping, so
+    concurrent senders to one chat are spaced out instead of bursting together.
+    """
+    
+    MAX_TRACKED_CHATS = 10000
+    
+    def __init__(self, per_chat_interval: float = 1.0):
+        self.per_chat_interval = per_chat_interval
+        self._next_slot: Dict[int, float] = {}
+    
+    async def acquire(self, chat_id: int):
+        now = time.monotonic()
+        slot = max(now, self._next_slot.get(chat_id, 0.0))
+        self._next_slot[chat_id] = slot + self.per_chat_interval
+        
+        if len(self._next_slot) > self.MAX_TRACKED_CHATS:
+            self._next_slot = {chat: ts for chat, ts in self._next_slot.items() if ts > now}
+        
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+# ========== OUTBOUND SCHEDULER ==========
+class OutboundScheduler:
+    """Single gate for Telegram requests, with strict priority lanes.
+    
+    Callers wait out their chat's interval, then queue for a token from the
+    global bucket; a dispatcher hands tokens to the highest-priority lane
+    first, so a running broadcast only uses what deliveries leave over.
+    FloodWait pauses the global bucket and the request is retried. Requests
+    made without call() (message.reply, edit_text, callback answers) are
+    gated in TracedClient.invoke on the edit lane. The background lane is
+    guaranteed one token in every BACKGROUND_SHARE while it has work, so it
+    cannot starve under sustained load.
+    """
+    
+    DELIVERY, EDIT, BULK, BACKGROUND = range(4)
+    LANE_NAMES = ("delivery", "edit", "bulk", "background")
+    MAX_ATTEMPTS = 3
+    BACKGROUND_SHARE = 10
+    
+    def __init__(self, rate: float = 28, per_chat_interval: float = 1.0):
+        self.bucket = TokenBucket(rate)
+        self.chats = ChatRateLimiter(per_chat_interval)
+        self._lanes = [deque() for _ in self.LANE_NAMES]  # per lane: (enqueued_at, future)
+        self._since_background = 0  # grants since the background lane was last served
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.depth = [0] * len(self.LANE_NAMES)
+        self.granted = [0] * len(self.LANE_NAMES)
+        self.wait_total = [0.0] * len(self.LANE_NAMES)
+        self.wait_max = [0.0] * len(self.LANE_NAMES)
+        self.flood_waits = [0] * len(self.LANE_NAMES)
+        self._granted: contextvars.ContextVar = contextvars.ContextVar("outbound_granted", default=False)
+    
+    @property
+    def granted_here(self) -> bool:
+        """True inside a call() that already holds a token, so invoke() does not gate twice"""
+        return self._granted.get()
+    
+    def _next_lane(self) -> Optional[int]:
+        """Highest-priority lane with work, except every BACKGROUND_SHARE-th grant"""
+        if self._lanes[self.BACKGROUND] and self._since_background >= self.BACKGROUND_SHARE - 1:
+            return self.BACKGROUND
+        for lane, queue in enumerate(self._lanes):
+            if queue:
+                return lane
+        return None
+    
+    async def _dispatch(self):
+        while True:
+            await self._ready.wait()
+            await self.bucket.acquire()
+            
+            while True:
+                lane = self._next_lane()
+                if lane is None:
+                    break
+                enqueued_at, future = self._lanes[lane].popleft()
+                self.depth[lane] -= 1
+                if future.done():
+                    continue  # caller went away
+                
+                self._since_background = 0 if lane == self.BACKGROUND else self._since_background + 1
+                waited = time.monotonic() - enqueued_at
+                metrics.observe("bot_outbound_wait_seconds", waited, lane=self.LANE_NAMES[lane])
+                self.granted[lane] += 1
+                self.wait_total[lane] += waited
+                self.wait_max[lane] = max(self.wait_max[lane], waited)
+                future.set_result(None)
+                break
+            
+            if not any(self._lanes):
+                self._ready.clear()
+    
+    async def _grant(self, lane: int):
+        """Wait for this request's turn at the global bucket"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._dispatch())
+        
+        future = asyncio.get_running_loop().create_future()
+        self._lanes[lane].append((time.monotonic(), future))
+        self.depth[lane] += 1
+        self._ready.set()
+        await future
+    
+    async def call(self, lane: int, chat_id: Optional[int], method, /, *args, **kwargs):
+        """Run `method(*args, **kwargs)` once rate limits allow; chat_id=None skips per-chat spacing.
+        
+        Own parameters are positional-only so the method's keywords (e.g.
+        copy_message(chat_id=...)) are passed through instead of clashing.
+        """
+        method_name = getattr(method, "__name__", "call")
+        for attempt in range(self.MAX_ATTEMPTS):
+            with tracer.span("outbound.wait", lane=self.LANE_NAMES[lane]):
+                if chat_id is not None:
+                    await self.chats.acquire(chat_id)
+                await self._grant(lane)
+            start = time.perf_counter()
+            granted = self._granted.set(True)
+            try:
+                with tracer.span(f"outbound.{method_name}"):
+                    return await method(*args, **kwargs)
+            except FloodWait as e:
+                self.flood_waits[lane] += 1
+                logger.warning(f"⏳ FloodWait {e.value}s on {self.LANE_NAMES[lane]} lane")
+                self.bucket.pause(e.value + 1)
+                if attempt == self.MAX_ATTEMPTS - 1:
+                    raise
+            finally:
+                self._granted.reset(granted)
+                metrics.observe(
+                    "bot_outbound_seconds", time.perf_counter() - start,
+                    lane=self.LANE_NAMES[lane], method=method_name
+                )
+    
+    def stats(self) -> Dict:
+        return {
+            name: {
+                "depth": self.depth[lane],
+                "granted": self.granted[lane],
+                "avg_wait": self.wait_total[lane] / self.granted[lane] if self.granted[lane] else 0.0,
+                "max_wait": self.wait_max[lane],
+                "flood_waits": self.flood_waits[lane],
+            }
+            for lane, name in enumerate(self.LANE_NAMES)
+        }
 
 # ========== BROADCAST SYSTEM ==========
+# Errors meaning a user can never receive messages from the bot
+PERMANENT_DELIVERY_ERRORS = (
+    UserIsBlocked, InputUserDeactivated, UserDeactivated, UserDeactivatedBan, PeerIdInvalid
+)
+
 class BroadcastSystem:
-    async def broadcast_message(self, client: Client, message_text: str, owner_id: int):
-        """Broadcast message to all users"""
+    """Persisted, resumable broadcast jobs.
+    
+    Users are processed in ascending id order in batches. A job document in
+    the `broadcasts` collection stores the last fully processed user id
+    (`checkpoint`) plus the ids already handled inside the current batch
+    (`done_ids`), so a paused or interrupted job resumes without re-sending.
+    Users marked unreachable are skipped through an indexed filter.
+    """
+    
+    CHECKPOINT_INTERVAL = 1.0  # seconds between persisted checkpoints
+    
+    def __init__(self, workers: int = 20, rate: float = 25, progress_interval: float = 5, batch_size: int = 500):
+        self.workers = workers
+        self.bucket = TokenBucket(rate)  # caps broadcasts below the shared outbound budget
+        self.progress_interval = progress_interval
+        self.batch_size = batch_size
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self._pause_requested: Set[str] = set()
+    
+    @property
+    def jobs(self):
+        return db.db.broadcasts
+    
+    async def create_job(self, owner_id: int, message_text: str) -> str:
+        """Persist a draft broadcast awaiting confirmation"""
+        job_id = uuid.uuid4().hex[:8]
+        await self.jobs.insert_one({
+            "job_id": job_id,
+            "owner_id": owner_id,
+            "text": message_text,
+            "status": "draft",
+            "checkpoint": None,
+            "done_ids": [],
+            "success": 0,
+            "failed": 0,
+            "total": 0,
+            "created_at": datetime.now(),
+            "updated_at": datetime.now()
+        })
+        return job_id
+    
+    async def get_job(self, job_id: str) -> Optional[Dict]:
+        return await self.jobs.find_one({"job_id": job_id}, {"_id": 0, "done_ids": 0})
+    
+    async def list_jobs(self, limit: int = 10) -> List[Dict]:
+        return await self.jobs.find({}, {"_id": 0, "done_ids": 0}).sort("created_at", -1).to_list(length=limit)
+    
+    def stopping(self, job_id: str) -> bool:
+        """Whether a paused or cancelled job's task is still finishing its in-flight sends"""
+        return job_id in self.tasks and job_id in self._pause_requested
+    
+    async def start(self, client: Client, job_id: str) -> bool:
+        """Start a draft or resume a paused job; False if it is not startable.
+        
+        A job whose previous task has not exited yet is refused, otherwise two
+        tasks would send the same batch.
+        """
+        if job_id in self.tasks:
+            return False
+        
+        job = await self.jobs.find_one_and_update(
+            {"job_id": job_id, "status": {"$in": ["draft", "paused"]}},
+            {"$set": {"status": "running", "updated_at": datetime.now()}}
+        )
+        if not job:
+            return False
+        
+        self._pause_requested.discard(job_id)
+        self.tasks[job_id] = asyncio.create_task(self.run_job(client, job_id))
+        return True
+    
+    async def pause(self, job_id: str) -> bool:
+        """Ask a running job to stop at the next user and checkpoint"""
+        result = await self.jobs.update_one(
+            {"job_id": job_id, "status": "running"},
+            {"$set": {"status": "paused", "updated_at": datetime.now()}}
+        )
+        if result.modified_count:
+            if job_id in self.tasks:
+                self._pause_requested.add(job_id)
+            return True
+        return False
+    
+    async def cancel(self, job_id: str) -> bool:
+        """Cancel a job that has not finished"""
+        result = await self.jobs.update_one(
+            {"job_id": job_id, "status": {"$in": ["draft", "running", "paused"]}},
+            {"$set": {"status": "cancelled", "updated_at": datetime.now()}}
+        )
+        if result.modified_count:
+            if job_id in self.tasks:
+                self._pause_requested.add(job_id)
+            return True
+        return False
+    
+    async def resume_interrupted(self, client: Client):
+        """Restart jobs that were running when the process stopped"""
+        async for job in self.jobs.find({"status": "running"}, {"job_id": 1}):
+            job_id = job["job_id"]
+            if job_id not in self.tasks:
+                logger.info(f"📢 Resuming interrupted broadcast {job_id}")
+                self.tasks[job_id] = asyncio.create_task(self.run_job(client, job_id))
+    
+    async def _send(self, client: Client, user_id: int, message_text: str) -> str:
+        """Send one message; returns "sent", "failed" or "unreachable".
+        
+        Rate limits and FloodWait retries are handled by the outbound
+        scheduler; permanent failures are recorded on the user so later
+        broadcasts skip them.
+        """
+        await self.bucket.acquire()
         try:
-            # Get all users
-            all_users = []
-            cursor = db.users.find({}, {"id": 1})
-            async for doc in cursor:
-                all_users.append(doc["id"])
+            await outbound.call(outbound.BULK, user_id, client.send_message, user_id, message_text)
+            return "sent"
+        except PERMANENT_DELIVERY_ERRORS as e:
+            await db.mark_unreachable(user_id, type(e).__name__)
+            return "unreachable"
+        except Exception as e:
+            logger.debug(f"Broadcast to {user_id} failed: {e}")
+            return "failed"
+    
+    @staticmethod
+    def format_job_list(jobs: List[Dict]) -> str:
+        """One line per job for /broadcasts and the broadcast menu"""
+        text = ""
+        for job in jobs:
+            done = job.get("success", 0) + job.get("failed", 0)
+            text += f"• `{job['job_id']}` - {job['status']} - {done}/{job.get('total', 0)}\n"
+            text += f"   {job['text'][:40]}\n"
+        return text
+    
+    @staticmethod
+    def format_progress(job: Dict, rate: float = None) -> str:
+        """Progress text for a job document"""
+        total = max(job.get("total", 0), 1)
+        done = job.get("success", 0) + job.get("failed", 0)
+        progress = min(100.0, done / total * 100)
+        bar_length = 20
+        filled = int(bar_length * progress / 100)
+        bar = "█" * filled + "░" * (bar_length - filled)
+        
+        text = f"📢 **Broadcast** `{job['job_id']}` - {job['status'].upper()}\n\n"
+        text += f"**Message:** {job['text'][:100]}...\n"
+        text += f"**Progress:** [{bar}] {progress:.1f}%\n"
+        text += f"✅ **{job.get('success', 0)}/{job.get('total', 0)}** sent | ❌ **{job.get('failed', 0)}** failed"
+        if job.get("unreachable") or job.get("skipped"):
+            text += f"\n🚫 {job.get('unreachable', 0)} newly unreachable | ⏭️ {job.get('skipped', 0)} skipped"
+        if rate is not None:
+            text += f"\n⚡ {rate:.1f} msg/s"
+        return text
+    
+    async def run_job(self, client: Client, job_id: str):
+        """Deliver a job from its checkpoint until done, paused or cancelled"""
+        owner_id = None
+        try:
+            job = await self.jobs.find_one({"job_id": job_id})
+            if not job or job["status"] != "running":
+                return
+            
+            message_text = job["text"]
+            owner_id = job["owner_id"]
+            checkpoint = job.get("checkpoint")
+            done_ids = set(job.get("done_ids", []))
+            counts = {
+                "success": job.get("success", 0),
+                "failed": job.get("failed", 0),
+                "unreachable": job.get("unreachable", 0)
+            }
+            
+            if not job.get("total"):
+                job["total"] = await db.users.count_documents(Database.REACHABLE_FILTER)
+                job["skipped"] = await db.count_unreachable_users()
+            
+            progress_msg_id = job.get("progress_message_id")
+            if not progress_msg_id:
+                progress_msg = await outbound.call(
+                    outbound.EDIT, None, client.send_message, owner_id, self.format_progress(job)
+                )
+                progress_msg_id = progress_msg.id
+            
+            await self.jobs.update_one(
+                {"job_id": job_id},
+                {"$set": {"total": job["total"], "skipped": job.get("skipped", 0),
+                          "progress_message_id": progress_msg_id,
+                          "started_at": job.get("started_at") or datetime.now()}}
+            )
+            
+            started = time.monotonic()
+            sent_this_run = 0
             
-            total_users = len(all_users)
+            async def save_checkpoint():
+                await self.jobs.update_one(
+                    {"job_id": job_id},
+                    {"$set": {
+                        "checkpoint": checkpoint,
+                        "done_ids": list(done_ids),
+                        "success": counts["success"],
+                        "failed": counts["failed"],
+                        "unreachable": counts["unreachable"],
+                        "updated_at": datetime.now()
+                    }}
+                )
+            
+            async def report_progress():
+                # Persist often, edit the progress message at a throttled rate
+                last_edit = time.monotonic()
+                while True:
+                    await asyncio.sleep(self.CHECKPOINT_INTERVAL)
+                    await save_checkpoint()
+                    if time.monotonic() - last_edit >= self.progress_interval:
+                        last_edit = time.monotonic()
+                        rate = sent_this_run / max(time.monotonic() - started, 1e-6)
+                        snapshot = {**job, **counts, "status": "running"}
+                        try:
+                            await outbound.call(
+                                outbound.EDIT, None, client.edit_message_text,
+                                owner_id, progress_msg_id, self.format_progress(snapshot, rate)
+                            )
+                        except Exception:
+                            pass
+            
+            reporter = asyncio.create_task(report_progress())
+            try:
+                while job_id not in self._pause_requested:
+                    batch_filter = dict(Database.REACHABLE_FILTER)
+                    if checkpoint is not None:
+                        batch_filter["id"] = {"$gt": checkpoint}
+                    batch = await db.users.find(batch_filter, {"_id": 0, "id": 1}).sort("id", 1).limit(self.batch_size).to_list(length=self.batch_size)
+                    if not batch:
+                        break
+                    
+                    queue = asyncio.Queue()
+                    for doc in batch:
+                        if doc["id"] not in done_ids:
+                            queue.put_nowait(doc["id"])
+                    
+                    async def work():
+                        nonlocal sent_this_run
+                        while not queue.empty() and job_id not in self._pause_requested:
+                            user_id = queue.get_nowait()
+                            result = await self._send(client, user_id, message_text)
+                            if result == "sent":
+                                counts["success"] += 1
+                            else:
+                                counts["failed"] += 1
+                                if result == "unreachable":
+                                    counts["unreachable"] += 1
+                            done_ids.add(user_id)
+                            sent_this_run += 1
+                    
+                    await asyncio.gather(*(work() for _ in range(self.workers)))
+                    
+                    if job_id in self._pause_requested:
+                        break
+                    checkpoint = batch[-1]["id"]
+                    done_ids.clear()
+            finally:
+                reporter.cancel()
+                await save_checkpoint()
             
-            if total_users == 0:
-                await client.send_message(owner_id, "❌ No users to broadcast to.")
+            job = await self.jobs.find_one({"job_id": job_id}, {"_id": 0, "done_ids": 0})
+            if job_id in self._pause_requested:
+                # Paused or cancelled from an admin command
+                await outbound.call(
+                    outbound.EDIT, None, client.edit_message_text, owner_id, progress_msg_id, self.format_progress(job)
+                )
                 return
             
-            # Send initial progress
-            progress_msg = await client.send_message(
-                owner_id,
-                f"📢 **Starting Broadcast**\n\n"
-                f"**Message:** {message_text[:100]}...\n"
-                f"**Recipients:** {total_users} users\n"
-                f"**Progress:** 0/{total_users} (0%)\n"
-                f"⏳ Please wait..."
+            elapsed = time.monotonic() - started
+            success, failed = counts["success"], counts["failed"]
+            attempted = success + failed
+            
+            # The job document doubles as the broadcast log read by the daily report
+            await self.jobs.update_one(
+                {"job_id": job_id},
+                {"$set": {"status": "completed", "finished_at": datetime.now(),
+                          "total_users": attempted, "duration": elapsed}}
             )
             
-            success = 0
-            failed = 0
+            # Send completion report
+            report = f"✅ **Broadcast Complete!** `{job_id}`\n\n"
+            report += f"📊 **Statistics:**\n"
+            report += f"• Total Users: {attempted}\n"
+            report += f"• Successfully Sent: {success} ({success/max(attempted, 1)*100:.1f}%)\n"
+            report += f"• Failed: {failed} ({counts['unreachable']} now marked unreachable)\n"
+            report += f"• Skipped Unreachable: {job.get('skipped', 0)} (sends saved)\n"
+            report += f"• Duration: {elapsed:.0f}s ({sent_this_run/max(elapsed, 1e-6):.1f} msg/s)\n"
+            
+            await outbound.call(outbound.EDIT, None, client.edit_message_text, owner_id, progress_msg_id, report)
             
-            # Broadcast with delay to avoid rate limits
-            for i, user_id in enumerate(all_users, 1):
-                try:
-                    await client.send_message(user_id, message_text)
-                    success += 1
-                except:
-                    failed += 1
+        except Exception as e:
+            logger.error(f"Broadcast error ({job_id}): {e}")
+            result = await self.jobs.update_one(
+                {"job_id": job_id, "status": "running"},
+                {"$set": {"status": "paused", "error": str(e)[:200], "updated_at": datetime.now()}}
+            )
+            # Only a job that was actually stopped can be resumed
+            try:
+                if owner_id and result.modified_count:
+                    await client.send_message(owner_id, f"❌ Broadcast `{job_id}` stopped: {str(e)}\nResume with `/broadcast_resume {job_id}`")
+            except Exception:
+                pass
+        finally:
+            if self.tasks.get(job_id) is asyncio.current_task():
+                self.tasks.pop(job_id)
+            self._pause_requested.discard(job_id)
+
+# ========== CATALOG REINDEX ==========
+class CatalogReindexer:
+    """Rebuild the books collection from the storage channel.
+    
+    Streams DATABASE_CHANNEL_ID by message id in chunks of up to 200, extracts
+    metadata for every document and upserts it with bulk_write keyed by
+    file_id (the channel message id). The last scanned message id is
+    checkpointed after every chunk, so an interrupted run resumes where it
+    stopped. Books that already exist keep their id, metadata, downloads and
+    rating; only file fields are refreshed.
+    """
+    
+    JOB_ID = "catalog"
+    
+    def __init__(self, chunk_size: int = 200, progress_interval: float = 5):
+        self.chunk_size = chunk_size
+        self.progress_interval = progress_interval
+        self.task: Optional[asyncio.Task] = None
+    
+    @property
+    def jobs(self):
+        return db.db.reindex_jobs
+    
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+    
+    async def get_job(self) -> Optional[Dict]:
+        return await self.jobs.find_one({"_id": self.JOB_ID})
+    
+    async def _top_message_id(self, client: Client) -> int:
+        """Newest message id in the channel, found by posting and removing a probe"""
+        probe = await client.send_message(config.DATABASE_CHANNEL_ID, "🔎 Reindex probe")
+        try:
+            await probe.delete()
+        except Exception:
+            pass
+        return probe.id - 1
+    
+    async def start(self, client: Client, chat_id: int, restart: bool = False) -> Optional[Dict]:
+        """Start a reindex, resuming an unfinished one unless restart is set"""
+        if self.running:
+            return None
+        
+        job = await self.get_job()
+        if restart or not job or job["status"] == "completed":
+            job = {
+                "_id": self.JOB_ID,
+                "status": "running",
+                "last_id": 0,
+                "top_id": await self._top_message_id(client),
+                "scanned": 0,
+                "documents": 0,
+                "inserted": 0,
+                "updated": 0,
+                "duplicates": 0,
+                "started": datetime.now(),
+                "elapsed": 0.0,
+            }
+            await self.jobs.replace_one({"_id": self.JOB_ID}, job, upsert=True)
+        else:
+            job["status"] = "running"
+            await self.jobs.update_one({"_id": self.JOB_ID}, {"$set": {"status": "running"}})
+        
+        self.task = asyncio.create_task(self.run(client, chat_id))
+        return job
+    
+    async def cancel(self) -> bool:
+        if not self.running:
+            return False
+        self.task.cancel()
+        return True
+    
+    async def resume_interrupted(self, client: Client):
+        """Continue a reindex that was running when the bot stopped"""
+        job = await self.get_job()
+        if job and job["status"] == "running":
+            logger.info(f"🔁 Resuming catalog reindex from message {job['last_id']}")
+            self.task = asyncio.create_task(self.run(client, config.OWNER_ID))
+    
+    def _book_ops(self, documents: List[Message]) -> List[UpdateOne]:
+        """Upserts for channel documents, keyed by their message ids"""
+        file_names = [msg.document.file_name or "Unknown" for msg in documents]
+        all_metadata = file_processor.extract_metadata_batch(file_names)
+        return [
+            self._book_op(msg, file_name, metadata)
+            for msg, file_name, metadata in zip(documents, file_names, all_metadata)
+        ]
+    
+    def _book_op(self, msg: Message, file_name: str, metadata: Dict) -> UpdateOne:
+        file = msg.document
+        book = file_processor.build_book(
+            file_name, file.file_size, msg.id, config.OWNER_ID, metadata,
+            file_processor.clean_filename_sync(file_name)
+        )
+        book.file_unique_id = file.file_unique_id
+        doc = book.to_dict()
+        file_fields = {key: doc.pop(key) for key in ("file_type", "file_size", "file_name", "file_unique_id")}
+        doc.pop("file_id")
+        return UpdateOne(
+            {"file_id": book.file_id},
+            {"$set": file_fields, "$setOnInsert": doc},
+            upsert=True
+        )
+    
+    async def _fetch(self, client: Client, ids: List[int]) -> List[Message]:
+        while True:
+            try:
+                messages = await client.get_messages(config.DATABASE_CHANNEL_ID, ids)
+                return messages if isinstance(messages, list) else [messages]
+            except FloodWait as e:
+                logger.warning(f"⏳ Reindex FloodWait {e.value}s")
+                await asyncio.sleep(e.value + 1)
+    
+    def format_progress(self, job: Dict) -> str:
+        status_icon = {"running": "🔄", "completed": "✅", "cancelled": "⏹️", "failed": "❌"}.get(job["status"], "⏳")
+        top = max(job["top_id"], 1)
+        percent = min(job["last_id"] / top * 100, 100)
+        rate = job["scanned"] / job["elapsed"] if job.get("elapsed") else 0
+        remaining = (top - job["last_id"]) / rate if rate else 0
+        
+        text = f"{status_icon} **CATALOG REINDEX: {job['status'].upper()}**\n\n"
+        text += f"📨 Messages: {job['last_id']:,}/{job['top_id']:,} ({percent:.1f}%)\n"
+        text += f"📚 Documents: {job['documents']:,}\n"
+        text += f"➕ Inserted: {job['inserted']:,} | ♻️ Updated: {job['updated']:,}\n"
+        if job.get("duplicates"):
+            text += f"🧬 Duplicate copies skipped: {job['duplicates']:,} (merge with `/dedupe`)\n"
+        text += f"⚡ {rate:.0f} msg/s"
+        if job["status"] == "running" and rate:
+            text += f" | ⏱️ ~{remaining / 60:.0f} min left"
+        return text
+    
+    async def run(self, client: Client, chat_id: int):
+        job = await self.get_job()
+        progress_msg = None
+        try:
+            progress_msg = await outbound.call(
+                outbound.EDIT, None, client.send_message, chat_id, self.format_progress(job)
+            )
+        except Exception as e:
+            logger.error(f"Reindex progress message error: {e}")
+        
+        last_edit = time.monotonic()
+        resumed_at = time.monotonic()
+        elapsed_before = job.get("elapsed", 0.0)
+        
+        try:
+            while job["last_id"] < job["top_id"]:
+                first = job["last_id"] + 1
+                ids = list(range(first, min(first + self.chunk_size, job["top_id"] + 1)))
+                messages = await self._fetch(client, ids)
                 
-                # Update progress every 10 users
-                if i % 10 == 0 or i == total_users:
-                    progress = (i / total_users) * 100
-                    bar_length = 20
-                    filled = int(bar_length * progress / 100)
-                    bar = "█" * filled + "░" * (bar_length - filled)
-                    
+                ops = self._book_ops([msg for msg in messages if not msg.empty and msg.document])
+                if ops:
                     try:
-                        await progress_msg.edit_text(
-                            f"📢 **Broadcasting...**\n\n"
-                            f"**Message:** {message_text[:100]}...\n"
-                            f"**Progress:** [{bar}] {progress:.1f}%\n"
-                            f"✅ **{success}/{total_users}** sent | ❌ **{failed}** failed"
-                        )
-                    except:
-                        pass
+                        result = await db.books.bulk_write(ops, ordered=False)
+                        job["inserted"] += result.upserted_count
+                        job["updated"] += result.matched_count
+                    except BulkWriteError as e:
+                        # Copies of a file already in the catalog hit the file_unique_id index
+                        details = e.details
+                        job["inserted"] += details.get("nUpserted", 0)
+                        job["updated"] += details.get("nMatched", 0)
+                        job["duplicates"] += sum(1 for error in details.get("writeErrors", []) if error.get("code") == 11000)
+                        if any(error.get("code") != 11000 for error in details.get("writeErrors", [])):
+                            raise
+                
+                job["last_id"] = ids[-1]
+                job["scanned"] += len(ids)
+                job["documents"] += len(ops)
+                job["elapsed"] = elapsed_before + time.monotonic() - resumed_at
+                await self.jobs.update_one({"_id": self.JOB_ID}, {"$set": {
+                    key: job[key] for key in ("last_id", "scanned", "documents", "inserted", "updated", "duplicates", "elapsed")
+                }})
                 
-                # Small delay to avoid rate limiting
-                if i % 30 == 0:
-                    await asyncio.sleep(1)
+                if progress_msg and time.monotonic() - last_edit >= self.progress_interval:
+                    last_edit = time.monotonic()
+                    try:
+                        await outbound.call(outbound.EDIT, None, progress_msg.edit_text, self.format_progress(job))
+                    except Exception:
+                        pass
             
-            # Send completion report
-            report = f"✅ **Broadcast Complete!**\n\n"
-            report += f"📊 **Statistics:**\n"
-            report += f"• Total Users: {total_users}\n"
-            report += f"• Successfully Sent: {success} ({success/total_users*100:.1f}%)\n"
-            report += f"• Failed: {failed}\n"
-            
-            await progress_msg.edit_text(report)
-            
-            # Log broadcast
-            await db.stats.insert_one({
-                "type": "broadcast",
-                "timestamp": datetime.now(),
-                "total_users": total_users,
-                "success": success,
-                "failed": failed,
-                "message_preview": message_text[:100]
-            })
+            job["status"] = "completed"
             
+            # Derived state follows the rebuilt collection
+            # Reconcile with an $inc of the difference so buffered upload increments are not overwritten
+            await db.counters.flush()
+            stored = await db.stats.find_one({"key": "total_books"}, {"_id": 0, "value": 1})
+            total = await db.books.count_documents({})
+            difference = total - (stored or {}).get("value", 0)
+            if difference:
+                await db.update_stats("total_books", difference)
+            if config.SEARCH_MODE == "index":
+                await db.search_index.build(db.books)
+            db.search_cache.invalidate()
+            logger.info(f"✅ Catalog reindex done: {job['documents']} documents, {job['inserted']} new books")
+            
+        except asyncio.CancelledError:
+            job["status"] = "cancelled"
         except Exception as e:
-            logger.error(f"Broadcast error: {e}")
-            await client.send_message(owner_id, f"❌ Broadcast failed: {str(e)}")
+            logger.error(f"❌ Catalog reindex failed at message {job['last_id']}: {e}")
+            job["status"] = "failed"
+        finally:
+            await self.jobs.update_one({"_id": self.JOB_ID}, {"$set": {"status": job["status"], "finished": datetime.now()}})
+            if progress_msg:
+                try:
+                    await outbound.call(outbound.EDIT, None, progress_msg.edit_text, self.format_progress(job))
+                except Exception:
+                    pass
 
 # ========== ANALYTICS SYSTEM ==========
 class Analytics:
@@ -715,7 +3097,22 @@ class Analytics:
             if trending:
                 report += "🔥 **Trending Books:**\n"
                 for i, book in enumerate(trending, 1):
-                    report += f"{i}. {book.title[:30]}... ({book.downloads} 📥)\n"
+                    report += f"{i}. {book.title[:30]}... ({db.trending.window_downloads(book.id)} 📥 {db.trending.window_label})\n"
+            
+            # Send volume saved by skipping unreachable users
+            unreachable = await db.count_unreachable_users()
+            since = datetime.now() - timedelta(days=1)
+            broadcasts = await db.db.broadcasts.find(
+                {"status": "completed", "finished_at": {"$gte": since}},
+                {"_id": 0, "skipped": 1, "unreachable": 1}
+            ).to_list(length=None)
+            
+            report += "\n📢 **Delivery Health:**\n"
+            report += f"• Unreachable Users: {unreachable:,} (skipped by broadcasts)\n"
+            if broadcasts:
+                report += f"• Broadcasts (last 24h): {len(broadcasts)}\n"
+                report += f"• Sends Saved: {sum(b.get('skipped', 0) for b in broadcasts):,}\n"
+                report += f"• Newly Unreachable: {sum(b.get('unreachable', 0) for b in broadcasts):,}\n"
             
             report += "\n" + "─" * 40 + "\n"
             report += "💎 **Owner Actions:** /broadcast | /stats"
@@ -725,16 +3122,178 @@ class Analytics:
             logger.error(f"Error generating report: {e}")
             return "❌ Error generating daily report."
 
+# ========== CALLBACK ROUTER ==========
+CALLBACK_DATA_LIMIT = 64  # bytes Telegram accepts in callback_data
+
+class CallbackRoute:
+    __slots__ = ("key", "handler", "admin", "latency", "calls", "errors")
+    
+    def __init__(self, key: str, handler, admin: bool = False):
+        self.key = key
+        self.handler = handler  # async (client, callback_query, arg) -> None
+        self.admin = admin
+        self.latency = LatencyHistogram()
+        self.calls = 0
+        self.errors = 0
+
+class CallbackRouter:
+    """Routing table for callback data.
+    
+    Exact keys ("trending") are a single dict lookup; prefix keys ("get_")
+    are looked up at each '_' within the longest registered prefix, so the
+    cost does not grow with the number of routes. Handlers receive the text
+    after the prefix. Middleware wraps every dispatch as
+    `await middleware(client, callback_query, route, call_next)`, and each
+    route records its own latency histogram and error count.
+    """
+    
+    def __init__(self):
+        self._exact: Dict[str, CallbackRoute] = {}
+        self._prefix: Dict[str, CallbackRoute] = {}
+        self._max_prefix_len = 0
+        self._middleware: List = []
+        self.unknown = 0
+    
+    def exact(self, key: str, admin: bool = False):
+        def decorator(handler):
+            self._exact[key] = CallbackRoute(key, handler, admin)
+            return handler
+        return decorator
+    
+    def prefix(self, key: str, admin: bool = False):
+        assert key.endswith("_"), "prefix routes end with '_'"
+        def decorator(handler):
+            self._prefix[key] = CallbackRoute(key, handler, admin)
+            self._max_prefix_len = max(self._max_prefix_len, len(key))
+            return handler
+        return decorator
+    
+    def use(self, middleware):
+        self._middleware.append(middleware)
+        return middleware
+    
+    def resolve(self, data: str):
+        """Return (route, argument) for callback data, or (None, "")"""
+        route = self._exact.get(data)
+        if route:
+            return route, ""
+        
+        # Longest matching prefix wins ("random_another_" over "random_")
+        end = data.rfind("_", 0, self._max_prefix_len)
+        while end != -1:
+            route = self._prefix.get(data[:end + 1])
+            if route:
+                return route, data[end + 1:]
+            end = data.rfind("_", 0, end)
+        return None, ""
+    
+    async def dispatch(self, client: Client, callback_query: CallbackQuery):
+        route, arg = self.resolve(callback_query.data or "")
+        if route is None:
+            self.unknown += 1
+            await callback_query.answer("⚠️ Action not available!")
+            return
+        
+        async def call_handler():
+            await route.handler(client, callback_query, arg)
+        
+        call_next = call_handler
+        for middleware in reversed(self._middleware):
+            call_next = (lambda mw, nxt: lambda: mw(client, callback_query, route, nxt))(middleware, call_next)
+        
+        route.calls += 1
+        start = time.perf_counter()
+        try:
+            await call_next()
+        except Exception as e:
+            route.errors += 1
+            logger.error(f"Callback {route.key} error: {e}")
+            try:
+                await callback_query.answer("❌ Error processing request!")
+            except:
+                pass
+        finally:
+            route.latency.observe(time.perf_counter() - start)
+    
+    def routes(self) -> List[CallbackRoute]:
+        return list(self._exact.values()) + list(self._prefix.values())
+    
+    def stats(self) -> List[Dict]:
+        """Per-route counters, slowest p95 first"""
+        rows = [
+            {
+                "route": route.key,
+                "calls": route.calls,
+                "errors": route.errors,
+                "p50": route.latency.quantile(0.5),
+                "p95": route.latency.quantile(0.95),
+                "mean": route.latency.mean,
+            }
+            for route in self.routes() if route.calls
+        ]
+        return sorted(rows, key=lambda row: -row["p95"])
+
 # ========== INITIALIZE COMPONENTS ==========
+metrics = Metrics()
+tracer = Tracer(config.TRACE_SLOW_MS / 1000, config.TRACE_SAMPLE_RATE, config.TRACE_FILE, config.TRACE_TO_LOG_CHANNEL)
 db = Database()
 reaction_system = ReactionSystem(probability=config.REACTION_PROBABILITY)
 search_manager = SearchManager()
 file_processor = FileProcessor()
-broadcast_system = BroadcastSystem()
+outbound = OutboundScheduler(config.OUTBOUND_RATE, config.OUTBOUND_PER_CHAT_INTERVAL)
+broadcast_system = BroadcastSystem(config.BROADCAST_WORKERS, config.BROADCAST_RATE, config.BROADCAST_PROGRESS_INTERVAL)
+ingestion = IngestionPipeline(
+    config.INGEST_WORKERS, config.INGEST_INSERT_BATCH,
+    config.INGEST_PROGRESS_INTERVAL, config.INGEST_BATCH_IDLE
+)
+reindexer = CatalogReindexer(config.REINDEX_CHUNK, config.REINDEX_PROGRESS_INTERVAL)
 analytics = Analytics()
+callbacks = CallbackRouter()
+
+# Values read at scrape time
+metrics.describe("bot_handler_seconds", "Update handler latency by handler")
+metrics.describe("bot_db_seconds", "Database method latency")
+metrics.describe("bot_outbound_seconds", "Telegram API call latency by lane and method")
+metrics.describe("bot_outbound_wait_seconds", "Time queued for the outbound rate limiter")
+metrics.describe("bot_event_loop_lag_seconds", "Event loop wake-up delay")
+metrics.histogram_source(
+    "bot_callback_seconds", "Callback route latency",
+    lambda: (({"route": route.key}, route.latency) for route in callbacks.routes())
+)
+metrics.gauge(
+    "bot_callback_errors_total", "Callback handler errors by route",
+    lambda: {(("route", route.key),): route.errors for route in callbacks.routes()}, kind="counter"
+)
+metrics.gauge("bot_uptime_seconds", "Seconds since the process started", lambda: round(metrics.uptime, 1))
+metrics.gauge("bot_in_flight_updates", "Updates currently being handled", lambda: metrics.in_flight)
+metrics.gauge("bot_event_loop_lag_last_seconds", "Most recent event loop lag sample", lambda: round(metrics.loop_lag, 6))
+metrics.gauge("bot_process_resident_memory_bytes", "Process RSS", Metrics.rss_bytes)
+metrics.gauge("bot_search_cache_hits_total", "Search cache hits", lambda: db.search_cache.stats()["hits"], kind="counter")
+metrics.gauge("bot_search_cache_misses_total", "Search cache misses", lambda: db.search_cache.stats()["misses"], kind="counter")
+metrics.gauge("bot_search_cache_hit_ratio", "Search cache hit ratio", lambda: round(db.search_cache.stats()["hit_rate"] / 100, 4))
+metrics.gauge(
+    "bot_sessions", "Entries in the search session stores",
+    lambda: {(("store", "active"),): len(search_manager.active_searches),
+             (("store", "result_sets"),): len(search_manager.result_sets)}
+)
+metrics.gauge(
+    "bot_outbound_queue_depth", "Requests waiting per outbound lane",
+    lambda: {(("lane", name),): lane["depth"] for name, lane in outbound.stats().items()}
+)
+metrics.gauge("bot_counter_buffer_pending", "Buffered counter increments not yet written", lambda: db.counters.stats()["pending"])
 
 # ========== CREATE PYROGRAM APP ==========
-app = Client(
+class TracedClient(Client):
+    """Client whose raw API calls show up as spans and all pass the outbound scheduler"""
+    
+    async def invoke(self, query, *args, **kwargs):
+        with tracer.span(f"tg.{type(query).__name__}"):
+            if outbound.granted_here:
+                return await super().invoke(query, *args, **kwargs)
+            # Direct replies, edits and callback answers from handlers still take a global token
+            return await outbound.call(outbound.EDIT, None, super().invoke, query, *args, **kwargs)
+
+app = TracedClient(
     "book_bot",
     api_id=config.API_ID,
     api_hash=config.API_HASH,
@@ -750,7 +3309,7 @@ async def log_message(text: str):
     """Log message to log channel"""
     if config.LOG_CHANNEL_ID:
         try:
-            await app.send_message(config.LOG_CHANNEL_ID, text)
+            await outbound.call(outbound.BACKGROUND, config.LOG_CHANNEL_ID, app.send_message, config.LOG_CHANNEL_ID, text)
         except:
             pass
 
@@ -758,6 +3317,7 @@ async def log_message(text: str):
 
 # Start Command
 @app.on_message(filters.command("start"))
+@instrumented("command")
 async def start_command(client: Client, message: Message):
     """Handle /start command"""
     try:
@@ -783,7 +3343,7 @@ Your Digital Library Assistant
 🎯 **Quick Commands:**
 /books <name> - Search books instantly
 /categories - Browse by genre  
-/trending - Popular books today
+/trending - Popular books right now
 /save <id> - Save to wishlist
 /stats - Bot statistics
 
@@ -803,7 +3363,7 @@ Type /help for more commands!
         await message.reply_text(welcome_text, reply_markup=keyboard)
         
         # Add random reaction
-        await reaction_system.add_reaction(client, message.chat.id, message.id, 'text')
+        reaction_system.react(client, message.chat.id, message.id, 'text')
         
     except Exception as e:
         logger.error(f"Start command error: {e}")
@@ -811,6 +3371,7 @@ Type /help for more commands!
 
 # Help Command
 @app.on_message(filters.command("help"))
+@instrumented("command")
 async def help_command(client: Client, message: Message):
     """Handle /help command"""
     help_text = """
@@ -820,7 +3381,7 @@ async def help_command(client: Client, message: Message):
 /books <name> - Search for books
 /categories - Browse books by category
 /trending - See trending books
-/random - Get random book
+/random [category] - Get random book
 
 💾 **SAVE & ORGANIZE:**
 /save <book_id> - Save book to wishlist
@@ -832,6 +3393,10 @@ async def help_command(client: Client, message: Message):
 
 🛠️ **ADMIN COMMANDS:**
 /broadcast <msg> - Broadcast to all users
+/broadcasts - List broadcast jobs
+/broadcast_pause <id> | /broadcast_resume <id> | /broadcast_status <id>
+/reindex [restart|status|cancel] - Rebuild catalog from channel
+/dedupe - Merge duplicate books
 /lock - Enable maintenance mode  
 /unlock - Disable maintenance mode
 
@@ -845,6 +3410,7 @@ async def help_command(client: Client, message: Message):
 
 # Books Search Command
 @app.on_message(filters.command("books"))
+@instrumented("command")
 async def books_command(client: Client, message: Message):
     """Handle /books command"""
     try:
@@ -868,19 +3434,19 @@ async def books_command(client: Client, message: Message):
         # Send searching message
         search_msg = await message.reply(f"🔍 **Searching** `{query}`...")
         
-        # Search books
-        books = await db.search_books(query, limit=50)
+        # Keep the result set server-side and render page 1
+        token = search_manager.create_result_set(user.id, query)
+        results_text, keyboard, page_books = await search_manager.render_page(token, page=1)
+        total = search_manager.result_sets.get(token, {}).get('total', 0)
         
-        if not books:
+        if not page_books:
+            search_manager.result_sets.pop(token, None)
             await search_msg.edit(f"❌ **No books found for** `{query}`\n\nTry different keywords or check spelling.")
             return
         
-        # Format results (page 1)
-        results_text = await search_manager.format_search_results(books, page=1)
-        keyboard = await search_manager.create_search_keyboard(books, page=1)
-        
         # Send results
-        await search_msg.edit_text(
+        await outbound.call(
+            outbound.EDIT, None, search_msg.edit_text,
             results_text,
             reply_markup=keyboard,
             disable_web_page_preview=True
@@ -888,10 +3454,10 @@ async def books_command(client: Client, message: Message):
         
         # Store for auto-delete
         if config.AUTO_DELETE_SEARCHES:
-            await search_manager.store_search(user.id, search_msg.id, books)
+            await search_manager.store_search(user.id, search_msg.id, [book.id for book in page_books])
         
         # Log search
-        logger.info(f"User {user.id} searched: {query} - Found {len(books)} books")
+        logger.info(f"User {user.id} searched: {query} - Found {total} books")
         
     except Exception as e:
         logger.error(f"Books command error: {e}")
@@ -899,8 +3465,16 @@ async def books_command(client: Client, message: Message):
 
 # Categories Command
 @app.on_message(filters.command("categories"))
+@instrumented("command")
 async def categories_command(client: Client, message: Message):
     """Handle /categories command"""
+    await message.reply_text(
+        "📚 **Browse Categories**\n\nSelect a category to browse books:",
+        reply_markup=categories_keyboard()
+    )
+
+def categories_keyboard() -> InlineKeyboardMarkup:
+    """Two-column category picker shared by /categories and its button"""
     categories = [
         "📚 Programming", "🤖 AI & ML", "📊 Data Science",
         "💼 Business", "💰 Finance", "⚖️ Law",
@@ -922,16 +3496,17 @@ async def categories_command(client: Client, message: Message):
         keyboard.append(row)
     
     keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="back_to_main")])
-    
-    await message.reply_text(
-        "📚 **Browse Categories**\n\nSelect a category to browse books:",
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
+    return InlineKeyboardMarkup(keyboard)
 
 # Trending Command
 @app.on_message(filters.command("trending"))
+@instrumented("command")
 async def trending_command(client: Client, message: Message):
     """Handle /trending command"""
+    await send_trending(message)
+
+async def send_trending(message: Message):
+    """Reply with the trending leaderboard (shared with the trending button, outside @instrumented)"""
     try:
         trending_books = await db.get_trending_books(10)
         
@@ -939,13 +3514,13 @@ async def trending_command(client: Client, message: Message):
             await message.reply("📊 No trending books yet. Be the first to download!")
             return
         
-        text = "🔥 **TRENDING BOOKS TODAY**\n\n"
+        text = f"🔥 **TRENDING BOOKS** ({db.trending.window_label})\n\n"
         
         for i, book in enumerate(trending_books, 1):
             size_mb = book.file_size / (1024 * 1024)
             text += f"{i}. **{book.title[:35]}**\n"
             text += f"   👤 {book.author or 'Unknown'} | 📦 {size_mb:.1f}MB\n"
-            text += f"   ⭐ {book.rating:.1f} | 📥 {book.downloads} downloads\n"
+            text += f"   ⭐ {book.rating:.1f} | 📥 {db.trending.window_downloads(book.id)} in {db.trending.window_label} ({book.downloads} total)\n"
             if i < len(trending_books):
                 text += "   ─" * 20 + "\n"
         
@@ -968,6 +3543,7 @@ async def trending_command(client: Client, message: Message):
 
 # Stats Command
 @app.on_message(filters.command("stats"))
+@instrumented("command")
 async def stats_command(client: Client, message: Message):
     """Handle /stats command"""
     try:
@@ -980,6 +3556,20 @@ async def stats_command(client: Client, message: Message):
             total_searches = stats.get('total_searches', 0)
             
             success_rate = (total_downloads / total_searches * 100) if total_searches > 0 else 0
+            cache_stats = db.search_cache.stats()
+            counter_stats = db.counters.stats()
+            session_stats = search_manager.active_searches.stats()
+            result_set_stats = search_manager.result_sets.stats()
+            outbound_lines = "\n".join(
+                f"• {name}: {lane['depth']} queued | avg wait {lane['avg_wait'] * 1000:.0f}ms | "
+                f"max {lane['max_wait']:.1f}s | FloodWaits {lane['flood_waits']}"
+                for name, lane in outbound.stats().items()
+            )
+            route_lines = "\n".join(
+                f"• {row['route']}: p50 {row['p50'] * 1000:.0f}ms | p95 {row['p95'] * 1000:.0f}ms | "
+                f"{row['calls']:,} calls | {row['errors']} errors"
+                for row in callbacks.stats()[:5]
+            ) or "• No button presses yet"
             
             text = f"""
 📊 **ADMIN STATISTICS**
@@ -993,8 +3583,27 @@ async def stats_command(client: Client, message: Message):
 • Success Rate: {success_rate:.1f}%
 
 ⚡ **System:**
-• Uptime: 99.9%
+• Uptime: {metrics.format_uptime()}
 • Bot: @{config.BOT_USERNAME}
+
+🧮 **Counter Buffer:**
+• {counter_stats['increments']:,} increments → {counter_stats['writes']:,} writes ({counter_stats['pending']:,} pending)
+
+💬 **Search Sessions:**
+• Active: {session_stats['size']:,}/{session_stats['max_entries']:,} (~{session_stats['approx_bytes'] / 1024:.0f} KB)
+• Result Sets: {result_set_stats['size']:,} (~{result_set_stats['approx_bytes'] / 1024:.0f} KB)
+• Evicted: {session_stats['evictions'] + result_set_stats['evictions']:,} | Expired: {session_stats['expirations'] + result_set_stats['expirations']:,}
+
+🗃️ **Search Cache:**
+• Entries: {cache_stats['size']:,}/{cache_stats['max_size']:,}
+• Hit Rate: {cache_stats['hit_rate']:.1f}% ({cache_stats['hits']:,} hits / {cache_stats['misses']:,} misses)
+• Evictions: {cache_stats['evictions']:,} | Expired: {cache_stats['expirations']:,}
+
+📡 **Outbound Lanes:**
+{outbound_lines}
+
+🖱️ **Slowest Buttons (p95):**
+{route_lines}
 """
             
             keyboard = InlineKeyboardMarkup([
@@ -1035,6 +3644,7 @@ async def stats_command(client: Client, message: Message):
 
 # Broadcast Command (Admin Only)
 @app.on_message(filters.command("broadcast") & filters.user([config.OWNER_ID] + config.ADMIN_IDS))
+@instrumented("command")
 async def broadcast_command(client: Client, message: Message):
     """Handle /broadcast command (Admin only)"""
     try:
@@ -1044,11 +3654,14 @@ async def broadcast_command(client: Client, message: Message):
         
         broadcast_text = " ".join(message.command[1:])
         
+        # Persist as a draft job until confirmed
+        job_id = await broadcast_system.create_job(message.from_user.id, broadcast_text)
+        
         # Confirmation
         keyboard = InlineKeyboardMarkup([
             [
-                InlineKeyboardButton("✅ Confirm", callback_data=f"broadcast_confirm"),
-                InlineKeyboardButton("❌ Cancel", callback_data="broadcast_cancel")
+                InlineKeyboardButton("✅ Confirm", callback_data=f"broadcast_confirm_{job_id}"),
+                InlineKeyboardButton("❌ Cancel", callback_data=f"broadcast_cancel_{job_id}")
             ]
         ])
         
@@ -1060,17 +3673,133 @@ async def broadcast_command(client: Client, message: Message):
             reply_markup=keyboard
         )
         
-        # Store broadcast text temporarily
-        if not hasattr(client, 'pending_broadcasts'):
-            client.pending_broadcasts = {}
-        client.pending_broadcasts[message.from_user.id] = broadcast_text
-        
     except Exception as e:
         logger.error(f"Broadcast command error: {e}")
         await message.reply("❌ Error processing broadcast.")
 
+# Broadcast Job Commands (Admin Only)
+@app.on_message(filters.command("broadcasts") & filters.user([config.OWNER_ID] + config.ADMIN_IDS))
+@instrumented("command")
+async def broadcasts_command(client: Client, message: Message):
+    """List recent broadcast jobs"""
+    try:
+        jobs = await broadcast_system.list_jobs(10)
+        if not jobs:
+            await message.reply("📭 No broadcasts yet.")
+            return
+        
+        text = "📢 **RECENT BROADCASTS**\n\n"
+        text += broadcast_system.format_job_list(jobs)
+        text += "\n`/broadcast_status <id>` | `/broadcast_pause <id>` | `/broadcast_resume <id>`"
+        
+        await message.reply_text(text)
+    except Exception as e:
+        logger.error(f"Broadcasts command error: {e}")
+        await message.reply("❌ Error loading broadcasts.")
+
+@app.on_message(filters.command(["broadcast_status", "broadcast_pause", "broadcast_resume"]) & filters.user([config.OWNER_ID] + config.ADMIN_IDS))
+@instrumented("command")
+async def broadcast_job_command(client: Client, message: Message):
+    """Inspect, pause or resume a broadcast job"""
+    try:
+        action = message.command[0].split("_", 1)[1]
+        if len(message.command) < 2:
+            await message.reply(f"📢 **Usage:** `/broadcast_{action} <job_id>`\n\nSee `/broadcasts` for ids.")
+            return
+        
+        job_id = message.command[1]
+        
+        if action == "pause":
+            if await broadcast_system.pause(job_id):
+                await message.reply(f"⏸️ Broadcast `{job_id}` pausing at its next checkpoint.")
+            else:
+                await message.reply(f"❌ Broadcast `{job_id}` is not running.")
+            return
+        
+        if action == "resume":
+            if broadcast_system.stopping(job_id):
+                await message.reply(f"⏳ Broadcast `{job_id}` is still finishing its last sends, try again in a moment.")
+            elif await broadcast_system.start(client, job_id):
+                await message.reply(f"▶️ Broadcast `{job_id}` resumed from its checkpoint.")
+            else:
+                await message.reply(f"❌ Broadcast `{job_id}` is not paused.")
+            return
+        
+        job = await broadcast_system.get_job(job_id)
+        if not job:
+            await message.reply("❌ Broadcast not found.")
+            return
+        await message.reply_text(broadcast_system.format_progress(job))
+        
+    except Exception as e:
+        logger.error(f"Broadcast job command error: {e}")
+        await message.reply("❌ Error processing broadcast command.")
+
+@app.on_message(filters.command("reindex") & filters.user([config.OWNER_ID] + config.ADMIN_IDS))
+@instrumented("command")
+async def reindex_command(client: Client, message: Message):
+    """Rebuild the books collection from the storage channel"""
+    try:
+        action = message.command[1].lower() if len(message.command) > 1 else "start"
+        
+        if action == "status":
+            job = await reindexer.get_job()
+            if not job:
+                await message.reply("📭 No reindex has run yet.")
+                return
+            await message.reply_text(reindexer.format_progress(job))
+            return
+        
+        if action == "cancel":
+            if await reindexer.cancel():
+                await message.reply("⏹️ Reindex stopped. Run `/reindex` to resume from the checkpoint.")
+            else:
+                await message.reply("❌ No reindex is running.")
+            return
+        
+        if action not in ("start", "restart"):
+            await message.reply("🔁 **Usage:** `/reindex` | `/reindex restart` | `/reindex status` | `/reindex cancel`")
+            return
+        
+        job = await reindexer.start(client, message.chat.id, restart=action == "restart")
+        if not job:
+            await message.reply("⏳ A reindex is already running. See `/reindex status`.")
+            
+    except Exception as e:
+        logger.error(f"Reindex command error: {e}")
+        await message.reply(f"❌ Error starting reindex: {str(e)[:200]}")
+
+@app.on_message(filters.command("dedupe") & filters.user([config.OWNER_ID] + config.ADMIN_IDS))
+@instrumented("command")
+async def dedupe_command(client: Client, message: Message):
+    """Merge duplicate books and remove their extra channel copies"""
+    try:
+        status_msg = await message.reply("🧬 Looking for duplicate books...")
+        result = await db.merge_duplicates()
+        
+        # Drop the redundant files from the storage channel too
+        channel_ids = result["channel_ids"]
+        for i in range(0, len(channel_ids), 100):
+            try:
+                await outbound.call(
+                    outbound.BACKGROUND, None, client.delete_messages, config.DATABASE_CHANNEL_ID, channel_ids[i:i + 100]
+                )
+            except Exception as e:
+                logger.error(f"Dedupe channel cleanup error: {e}")
+        
+        await status_msg.edit_text(
+            f"✅ **DEDUPE COMPLETE**\n\n"
+            f"🧬 Groups merged: {result['groups']}\n"
+            f"🗑️ Books removed: {result['removed']}\n"
+            f"📥 Downloads carried over: {result['downloads_moved']}"
+        )
+    except Exception as e:
+        logger.error(f"Dedupe command error: {e}")
+        await message.reply(f"❌ Error during dedupe: {str(e)[:200]}")
+
 # Save Command
 @app.on_message(filters.command("save"))
+@instrumented("command")
 async def save_command(client: Client, message: Message):
     """Save book to wishlist"""
     try:
@@ -1082,7 +3811,7 @@ async def save_command(client: Client, message: Message):
         user_id = message.from_user.id
         
         # Check if book exists
-        book = await db.get_book(book_id)
+        book = await db.get_book(book_id, "listing")
         if not book:
             await message.reply("❌ Book not found. Please check the book ID.")
             return
@@ -1103,6 +3832,7 @@ async def save_command(client: Client, message: Message):
 
 # Wishlist Command
 @app.on_message(filters.command("wishlist"))
+@instrumented("command")
 async def wishlist_command(client: Client, message: Message):
     """View saved books"""
     try:
@@ -1143,19 +3873,38 @@ async def wishlist_command(client: Client, message: Message):
 
 # Random Command
 @app.on_message(filters.command("random"))
+@instrumented("command")
 async def random_command(client: Client, message: Message):
-    """Get a random book"""
+    """Get a random book, optionally from one category"""
+    category = " ".join(message.command[1:]) if message.command else ""
+    await send_random_book(message, category)
+
+def random_another_data(category: str) -> str:
+    """callback_data for "Another Random", cut on a UTF-8 boundary to fit Telegram's 64 bytes.
+    
+    A trailing "*" marks a truncated category key, matched as a prefix.
+    """
+    if not category:
+        return "random_another"
+    
+    data = f"random_another_{Book.category_key(category)}"
+    encoded = data.encode("utf-8")
+    if len(encoded) <= CALLBACK_DATA_LIMIT:
+        return data
+    return encoded[:CALLBACK_DATA_LIMIT - 1].decode("utf-8", errors="ignore") + "*"
+
+async def send_random_book(message: Message, category: str = "", prefix: bool = False):
+    """Pick one random book with a single $sample query and send it"""
     try:
-        # Get all books
-        books = await db.search_books("", limit=1000)
+        book = await db.get_random_book(category or None, prefix)
         
-        if not books:
-            await message.reply("📚 No books available yet.")
+        if not book:
+            if category:
+                await message.reply(f"📚 No books found in **{category}**.")
+            else:
+                await message.reply("📚 No books available yet.")
             return
         
-        # Pick random book
-        book = random.choice(books)
-        
         text = f"🎲 **RANDOM BOOK PICK**\n\n"
         text += f"📖 **Title:** {book.title}\n"
         text += f"👤 **Author:** {book.author or 'Unknown'}\n"
@@ -1166,13 +3915,14 @@ async def random_command(client: Client, message: Message):
         text += f"📥 **Downloads:** {book.downloads}\n"
         text += f"🎯 **Category:** {book.category}"
         
+        another = random_another_data(category)
         keyboard = InlineKeyboardMarkup([
             [
                 InlineKeyboardButton("📥 Download", callback_data=f"get_{book.id}"),
                 InlineKeyboardButton("💾 Save", callback_data=f"save_{book.id}")
             ],
             [
-                InlineKeyboardButton("🎲 Another Random", callback_data="random_another"),
+                InlineKeyboardButton("🎲 Another Random", callback_data=another),
                 InlineKeyboardButton("🔍 Search Similar", switch_inline_query_current_chat=book.category)
             ]
         ])
@@ -1185,158 +3935,183 @@ async def random_command(client: Client, message: Message):
 
 # ========== CALLBACK QUERY HANDLERS ==========
 
+@callbacks.use
+async def admin_guard(client: Client, callback_query: CallbackQuery, route: CallbackRoute, call_next):
+    """Reject admin-only routes for everyone else"""
+    if route.admin and not is_admin(callback_query.from_user.id):
+        await callback_query.answer("Admin only!", show_alert=True)
+        return
+    await call_next()
+
 @app.on_callback_query()
+@instrumented("callback")
 async def handle_callback_query(client: Client, callback_query: CallbackQuery):
     """Handle all callback queries"""
+    await callbacks.dispatch(client, callback_query)
+
+def wishlist_page(books: List[Book]):
+    """Wishlist text and keyboard (first five listed, three with actions)"""
+    text = "📚 **YOUR WISHLIST**\n\n"
+    
+    for i, book in enumerate(books[:5], 1):
+        text += f"{i}. **{book.title[:30]}**\n"
+        text += f"   👤 {book.author or 'Unknown'}\n"
+        text += f"   🆔 `{book.id}`\n"
+        if i < min(5, len(books)):
+            text += "   ─" * 20 + "\n"
+    
+    keyboard = []
+    for i, book in enumerate(books[:3]):
+        keyboard.append([
+            InlineKeyboardButton(f"📖 Get {book.title[:15]}...", callback_data=f"get_{book.id}"),
+            InlineKeyboardButton(f"❌ Remove", callback_data=f"remove_wish_{book.id}")
+        ])
+    
+    if len(books) > 3:
+        keyboard.append([InlineKeyboardButton("📄 View All Books", callback_data="view_all_wishlist")])
+    keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="my_stats")])
+    return text, InlineKeyboardMarkup(keyboard)
+
+# Get book
+@callbacks.prefix("get_")
+async def get_book_callback(client: Client, callback_query: CallbackQuery, book_id: str):
+    user_id = callback_query.from_user.id
+    message = callback_query.message
+    
+    book = await db.get_book(book_id, "delivery")
+    if not book:
+        await callback_query.answer("❌ Book not found!", show_alert=True)
+        return
+    
+    # Send file
     try:
-        data = callback_query.data
-        user_id = callback_query.from_user.id
-        message = callback_query.message
-        
-        # Get book
-        if data.startswith("get_"):
-            book_id = data.split("_", 1)[1]
-            
-            # Get book
-            book = await db.get_book(book_id)
-            if not book:
-                await callback_query.answer("❌ Book not found!", show_alert=True)
-                return
-            
-            # Send file
-            try:
-                # Forward file from database channel
-                await client.copy_message(
-                    chat_id=user_id,
-                    from_chat_id=config.DATABASE_CHANNEL_ID,
-                    message_id=int(book.file_id),
-                    caption=f"📖 **{book.title}**\n👤 {book.author or 'Unknown'}\n\n✅ Downloaded via @{config.BOT_USERNAME or 'book_bot'}"
-                )
-                
-                # Update download count
-                await db.update_download_count(book_id)
-                
-                # Update user download count
-                await db.users.update_one(
-                    {"id": user_id},
-                    {"$inc": {"downloads": 1}}
-                )
-                
-                # Delete search results if auto-delete is enabled
-                if config.AUTO_DELETE_SEARCHES:
-                    await search_manager.delete_search_immediately(user_id)
-                
-                # Send confirmation
-                await message.edit_text(
-                    f"✅ **DELIVERY COMPLETE!**\n\n"
-                    f"📖 *{book.title}*\n"
-                    f"👤 {book.author or 'Unknown'} | 📄 {book.file_type}\n"
-                    f"⏱️ Delivered instantly\n"
-                    f"🧹 Search list auto-cleaned\n\n"
-                    f"💡 *Pro Tip:* Use /save to bookmark",
-                    reply_markup=InlineKeyboardMarkup([
-                        [InlineKeyboardButton("📚 Search More", switch_inline_query_current_chat="")],
-                        [InlineKeyboardButton("🌟 Trending", callback_data="trending")],
-                        [InlineKeyboardButton("📊 My Stats", callback_data="my_stats")]
-                    ])
-                )
-                
-                await callback_query.answer("📚 Book sent successfully!")
-                
-                # Log download
-                logger.info(f"User {user_id} downloaded: {book.title}")
-                
-            except Exception as e:
-                logger.error(f"Error sending file: {e}")
-                await callback_query.answer("❌ Error sending file!", show_alert=True)
-        
-        # Pagination
-        elif data.startswith("prev_") or data.startswith("next_"):
-            try:
-                page = int(data.split("_")[1])
-                
-                # Extract query from message
-                msg_text = message.text
-                if "SEARCH RESULTS" in msg_text:
-                    # Find search term in message
-                    lines = msg_text.split("\n")
-                    query = ""
-                    
-                    for line in lines:
-                        if "Searching" in line:
-                            match = re.search(r'`(.+?)`', line)
-                            if match:
-                                query = match.group(1)
-                                break
-                    
-                    if query:
-                        # Re-search with new page
-                        books = await db.search_books(query, limit=50)
-                        
-                        if books:
-                            results_text = await search_manager.format_search_results(books, page)
-                            keyboard = await search_manager.create_search_keyboard(books, page)
-                            
-                            await message.edit_text(
-                                results_text,
-                                reply_markup=keyboard,
-                                disable_web_page_preview=True
-                            )
-                            
-                            await callback_query.answer(f"Page {page}")
-                        else:
-                            await callback_query.answer("No results!", show_alert=True)
-            except Exception as e:
-                logger.error(f"Pagination error: {e}")
-                await callback_query.answer("Error loading page!")
+        # Forward file from database channel
+        await outbound.call(
+            outbound.DELIVERY, user_id, client.copy_message,
+            chat_id=user_id,
+            from_chat_id=config.DATABASE_CHANNEL_ID,
+            message_id=int(book.file_id),
+            caption=f"📖 **{book.title}**\n👤 {book.author or 'Unknown'}\n\n✅ Downloaded via @{config.BOT_USERNAME or 'book_bot'}"
+        )
+    except Exception as e:
+        logger.error(f"Error sending file: {e}")
+        await callback_query.answer("❌ Error sending file!", show_alert=True)
+        return
+    
+    await callback_query.answer("📚 Book sent successfully!")
+    
+    # Update download counts
+    await db.update_download_count(book_id)
+    await db.update_user_download_count(user_id)
+    logger.info(f"User {user_id} downloaded: {book.title}")
+    
+    # Delete search results if auto-delete is enabled
+    deleted_id = None
+    if config.AUTO_DELETE_SEARCHES:
+        deleted_id = await search_manager.delete_search_immediately(user_id)
+    
+    # Send confirmation (as a new message when the button's message was just cleaned up)
+    confirmation = (
+        f"✅ **DELIVERY COMPLETE!**\n\n"
+        f"📖 *{book.title}*\n"
+        f"👤 {book.author or 'Unknown'} | 📄 {book.file_type}\n"
+        f"⏱️ Delivered instantly\n"
+        f"🧹 Search list auto-cleaned\n\n"
+        f"💡 *Pro Tip:* Use /save to bookmark"
+    )
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("📚 Search More", switch_inline_query_current_chat="")],
+        [InlineKeyboardButton("🌟 Trending", callback_data="trending")],
+        [InlineKeyboardButton("📊 My Stats", callback_data="my_stats")]
+    ])
+    try:
+        if message and message.id != deleted_id:
+            await outbound.call(outbound.EDIT, None, message.edit_text, confirmation, reply_markup=keyboard)
+        else:
+            await outbound.call(outbound.EDIT, None, client.send_message, user_id, confirmation, reply_markup=keyboard)
+    except Exception as e:
+        logger.debug(f"Delivery confirmation failed: {e}")
+
+# Pagination
+async def page_callback(client: Client, callback_query: CallbackQuery, arg: str):
+    try:
+        token, page = arg.rsplit("_", 1)
+        page = int(page)
         
-        # Clear search
-        elif data == "clear_search":
-            try:
-                await message.delete()
-                if user_id in search_manager.active_searches:
-                    del search_manager.active_searches[user_id]
-                await callback_query.answer("Search cleared!")
-            except:
-                await callback_query.answer("Already cleared!")
-        
-        # Categories
-        elif data.startswith("cat_"):
-            category = data.split("_", 1)[1]
-            # Search books by category
-            books = await db.search_books(category, limit=30)
-            
-            if books:
-                text = f"📚 **{category.upper()} BOOKS**\n\n"
-                for i, book in enumerate(books[:10], 1):
-                    text += f"{i}. **{book.title[:30]}**\n"
-                    text += f"   👤 {book.author or 'Unknown'}\n"
-                    text += f"   📥 {book.downloads} downloads\n"
-                    if i < min(10, len(books)):
-                        text += "   ─" * 20 + "\n"
-                
-                keyboard = []
-                for i, book in enumerate(books[:3]):
-                    keyboard.append([InlineKeyboardButton(f"📖 {book.title[:25]}...", callback_data=f"get_{book.id}")])
-                
-                keyboard.append([
-                    InlineKeyboardButton("⬅️ Back", callback_data="categories"),
-                    InlineKeyboardButton("🔍 Search", switch_inline_query_current_chat=category)
-                ])
-                
-                await message.edit_text(
-                    text,
-                    reply_markup=InlineKeyboardMarkup(keyboard)
-                )
-            else:
-                await callback_query.answer(f"No books in {category} category!", show_alert=True)
+        results_text, keyboard, _ = await search_manager.render_page(token, page)
+        if not results_text:
+            await callback_query.answer("⌛ Search expired, please search again.", show_alert=True)
+            return
         
-        # Back to main
-        elif data == "back_to_main":
-            stats = await db.get_stats()
-            total_books = stats.get('total_books', 0)
-            
-            welcome_text = f"""
+        await callback_query.message.edit_text(
+            results_text,
+            reply_markup=keyboard,
+            disable_web_page_preview=True
+        )
+        await callback_query.answer(f"Page {page}")
+    except Exception as e:
+        logger.error(f"Pagination error: {e}")
+        await callback_query.answer("Error loading page!")
+
+callbacks.prefix("prev_")(page_callback)
+callbacks.prefix("next_")(page_callback)
+
+# Clear search
+@callbacks.exact("clear_search")
+async def clear_search_callback(client: Client, callback_query: CallbackQuery, arg: str):
+    message = callback_query.message
+    try:
+        await message.delete()
+        await search_manager.discard_search(callback_query.from_user.id, message.id)
+        await callback_query.answer("Search cleared!")
+    except:
+        await callback_query.answer("Already cleared!")
+
+# Categories
+@callbacks.exact("categories")
+async def categories_callback(client: Client, callback_query: CallbackQuery, arg: str):
+    await callback_query.message.edit_text(
+        "📚 **Browse Categories**\n\nSelect a category to browse books:",
+        reply_markup=categories_keyboard()
+    )
+    await callback_query.answer()
+
+@callbacks.prefix("cat_")
+async def category_callback(client: Client, callback_query: CallbackQuery, category: str):
+    # Search books by category
+    books = await db.search_books(category, limit=30)
+    
+    if not books:
+        await callback_query.answer(f"No books in {category} category!", show_alert=True)
+        return
+    
+    text = f"📚 **{category.upper()} BOOKS**\n\n"
+    for i, book in enumerate(books[:10], 1):
+        text += f"{i}. **{book.title[:30]}**\n"
+        text += f"   👤 {book.author or 'Unknown'}\n"
+        text += f"   📥 {book.downloads} downloads\n"
+        if i < min(10, len(books)):
+            text += "   ─" * 20 + "\n"
+    
+    keyboard = []
+    for i, book in enumerate(books[:3]):
+        keyboard.append([InlineKeyboardButton(f"📖 {book.title[:25]}...", callback_data=f"get_{book.id}")])
+    
+    keyboard.append([
+        InlineKeyboardButton("⬅️ Back", callback_data="categories"),
+        InlineKeyboardButton("🔍 Search", switch_inline_query_current_chat=category)
+    ])
+    
+    await callback_query.message.edit_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    await callback_query.answer()
+
+# Back to main
+@callbacks.exact("back_to_main")
+async def back_to_main_callback(client: Client, callback_query: CallbackQuery, arg: str):
+    stats = await db.get_stats()
+    total_books = stats.get('total_books', 0)
+    
+    welcome_text = f"""
 🏠 **Main Menu**
 ──────────────────────────────
 
@@ -1346,57 +4121,87 @@ async def handle_callback_query(client: Client, callback_query: CallbackQuery):
 
 Select an option:
 """
-            
-            await message.edit_text(
-                welcome_text,
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("🔍 Search Books", switch_inline_query_current_chat="")],
-                    [InlineKeyboardButton("📚 Browse Categories", callback_data="categories")],
-                    [InlineKeyboardButton("🔥 Trending", callback_data="trending")],
-                    [InlineKeyboardButton("📊 My Stats", callback_data="my_stats")]
-                ])
-            )
-        
-        # Broadcast confirmation
-        elif data == "broadcast_confirm":
-            if is_admin(user_id):
-                # Get broadcast text from pending broadcasts
-                broadcast_text = getattr(client, 'pending_broadcasts', {}).get(user_id, "")
-                
-                if not broadcast_text:
-                    await callback_query.answer("No broadcast message found!", show_alert=True)
-                    return
-                
-                await message.edit_text("📢 Starting broadcast... Please wait.")
-                await callback_query.answer()
-                
-                # Start broadcast
-                await broadcast_system.broadcast_message(client, broadcast_text, user_id)
-                
-                # Clear pending broadcast
-                if hasattr(client, 'pending_broadcasts'):
-                    client.pending_broadcasts.pop(user_id, None)
-            else:
-                await callback_query.answer("Admin only!", show_alert=True)
-        
-        # Broadcast cancel
-        elif data == "broadcast_cancel":
-            await message.edit_text("❌ Broadcast cancelled.")
-            await callback_query.answer("Cancelled!")
-            
-            # Clear pending broadcast
-            if hasattr(client, 'pending_broadcasts'):
-                client.pending_broadcasts.pop(user_id, None)
-        
-        # My stats
-        elif data == "my_stats":
-            user = await db.get_or_create_user(
-                user_id,
-                callback_query.from_user.username or "",
-                callback_query.from_user.first_name or ""
-            )
-            
-            text = f"""
+    
+    await callback_query.message.edit_text(
+        welcome_text,
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("🔍 Search Books", switch_inline_query_current_chat="")],
+            [InlineKeyboardButton("📚 Browse Categories", callback_data="categories")],
+            [InlineKeyboardButton("🔥 Trending", callback_data="trending")],
+            [InlineKeyboardButton("📊 My Stats", callback_data="my_stats")]
+        ])
+    )
+    await callback_query.answer()
+
+# Broadcasts (admin)
+@callbacks.prefix("broadcast_confirm_", admin=True)
+async def broadcast_confirm_callback(client: Client, callback_query: CallbackQuery, job_id: str):
+    if not await broadcast_system.start(client, job_id):
+        await callback_query.answer("No pending broadcast found!", show_alert=True)
+        return
+    
+    await callback_query.message.edit_text(
+        f"📢 Broadcast `{job_id}` started.\n\n"
+        f"Progress is reported separately. Use `/broadcast_pause {job_id}` to pause."
+    )
+    await callback_query.answer()
+
+@callbacks.prefix("broadcast_cancel_", admin=True)
+async def broadcast_cancel_callback(client: Client, callback_query: CallbackQuery, job_id: str):
+    await broadcast_system.cancel(job_id)
+    await callback_query.message.edit_text("❌ Broadcast cancelled.")
+    await callback_query.answer("Cancelled!")
+
+@callbacks.exact("broadcast_menu", admin=True)
+async def broadcast_menu_callback(client: Client, callback_query: CallbackQuery, arg: str):
+    jobs = await broadcast_system.list_jobs(5)
+    
+    text = "📢 **BROADCAST MENU**\n\n"
+    text += "Send `/broadcast <message>` to create a broadcast.\n\n"
+    if jobs:
+        text += "**Recent jobs:**\n" + broadcast_system.format_job_list(jobs)
+        text += "\n`/broadcast_status <id>` | `/broadcast_pause <id>` | `/broadcast_resume <id>`"
+    else:
+        text += "📭 No broadcasts yet."
+    
+    await callback_query.message.edit_text(text)
+    await callback_query.answer()
+
+@callbacks.exact("user_stats", admin=True)
+async def user_stats_callback(client: Client, callback_query: CallbackQuery, arg: str):
+    overview = await db.get_user_overview()
+    if not overview:
+        await callback_query.answer("❌ Error loading users!", show_alert=True)
+        return
+    
+    text = f"""
+👥 **USER OVERVIEW**
+──────────────────────────────
+
+• Total Users: {overview['total']:,}
+• Active (24h): {overview['active_24h']:,}
+• New (7 days): {overview['new_7d']:,}
+• Unreachable: {overview['unreachable']:,}
+
+🏆 **Top Downloaders:**
+"""
+    for i, user in enumerate(overview["top"], 1):
+        name = f"@{user['username']}" if user.get("username") else (user.get("first_name") or user["id"])
+        text += f"{i}. {name} - {user.get('downloads', 0)} downloads\n"
+    
+    await callback_query.message.edit_text(text)
+    await callback_query.answer()
+
+# My stats
+@callbacks.exact("my_stats")
+async def my_stats_callback(client: Client, callback_query: CallbackQuery, arg: str):
+    user = await db.get_or_create_user(
+        callback_query.from_user.id,
+        callback_query.from_user.username or "",
+        callback_query.from_user.first_name or ""
+    )
+    
+    text = f"""
 📊 **YOUR STATISTICS**
 ──────────────────────────────
 
@@ -1411,183 +4216,133 @@ Select an option:
 • Wishlisted Books: {len(user.wishlist)}
 • Last Active: Today
 """
-            
-            await message.edit_text(
-                text,
-                reply_markup=InlineKeyboardMarkup([
-                    [InlineKeyboardButton("📚 Wishlist", callback_data="wishlist_view")],
-                    [InlineKeyboardButton("🔥 Trending", callback_data="trending")],
-                    [InlineKeyboardButton("🔙 Back", callback_data="back_to_main")]
-                ])
-            )
-        
-        # Wishlist view
-        elif data == "wishlist_view":
-            books = await db.get_user_wishlist(user_id)
-            
-            if not books:
-                await message.edit_text("📭 Your wishlist is empty.")
-                await callback_query.answer("Wishlist empty!")
-                return
-            
-            text = "📚 **YOUR WISHLIST**\n\n"
-            
-            for i, book in enumerate(books[:5], 1):
-                text += f"{i}. **{book.title[:30]}**\n"
-                text += f"   👤 {book.author or 'Unknown'}\n"
-                text += f"   🆔 `{book.id}`\n"
-                if i < min(5, len(books)):
-                    text += "   ─" * 20 + "\n"
-            
-            keyboard = []
-            for i, book in enumerate(books[:3]):
-                keyboard.append([
-                    InlineKeyboardButton(f"📖 Get {book.title[:15]}...", callback_data=f"get_{book.id}"),
-                    InlineKeyboardButton(f"❌ Remove", callback_data=f"remove_wish_{book.id}")
-                ])
-            
-            keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="my_stats")])
-            
-            await message.edit_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
-            await callback_query.answer()
-        
-        # Remove from wishlist
-        elif data.startswith("remove_wish_"):
-            book_id = data.split("_", 2)[2]
-            await db.remove_from_wishlist(user_id, book_id)
-            await callback_query.answer("Removed from wishlist!")
-            
-            # Refresh wishlist view
-            books = await db.get_user_wishlist(user_id)
-            
-            if books:
-                text = "📚 **YOUR WISHLIST**\n\n"
-                
-                for i, book in enumerate(books[:5], 1):
-                    text += f"{i}. **{book.title[:30]}**\n"
-                    text += f"   👤 {book.author or 'Unknown'}\n"
-                    text += f"   🆔 `{book.id}`\n"
-                    if i < min(5, len(books)):
-                        text += "   ─" * 20 + "\n"
-                
-                keyboard = []
-                for i, book in enumerate(books[:3]):
-                    keyboard.append([
-                        InlineKeyboardButton(f"📖 Get {book.title[:15]}...", callback_data=f"get_{book.id}"),
-                        InlineKeyboardButton(f"❌ Remove", callback_data=f"remove_wish_{book.id}")
-                    ])
-                
-                keyboard.append([InlineKeyboardButton("🔙 Back", callback_data="my_stats")])
-                
-                await message.edit_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
-            else:
-                await message.edit_text("📭 Your wishlist is now empty.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="my_stats")]]))
-        
-        # Clear wishlist
-        elif data == "clear_wishlist":
-            await db.users.update_one(
-                {"id": user_id},
-                {"$set": {"wishlist": []}}
-            )
-            await callback_query.answer("Wishlist cleared!")
-            await message.edit_text("📭 Your wishlist has been cleared.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="my_stats")]]))
-        
-        # Save book from callback
-        elif data.startswith("save_"):
-            book_id = data.split("_", 1)[1]
-            await db.add_to_wishlist(user_id, book_id)
-            await callback_query.answer("✅ Book saved to wishlist!")
-        
-        # Random another
-        elif data == "random_another":
-            await random_command(client, message)
-            await callback_query.answer()
-        
-        # Trending
-        elif data == "trending":
-            await trending_command(client, message)
-            await callback_query.answer()
-        
-        # Unknown callback
-        else:
-            await callback_query.answer("⚠️ Action not available!")
-            
-    except Exception as e:
-        logger.error(f"Callback query error: {e}")
-        try:
-            await callback_query.answer("❌ Error processing request!")
-        except:
-            pass
+    
+    await callback_query.message.edit_text(
+        text,
+        reply_markup=InlineKeyboardMarkup([
+            [InlineKeyboardButton("📚 Wishlist", callback_data="wishlist_view")],
+            [InlineKeyboardButton("🔥 Trending", callback_data="trending")],
+            [InlineKeyboardButton("🔙 Back", callback_data="back_to_main")]
+        ])
+    )
+    await callback_query.answer()
+
+# Wishlist
+@callbacks.exact("wishlist_view")
+async def wishlist_view_callback(client: Client, callback_query: CallbackQuery, arg: str):
+    books = await db.get_user_wishlist(callback_query.from_user.id)
+    
+    if not books:
+        await callback_query.message.edit_text("📭 Your wishlist is empty.")
+        await callback_query.answer("Wishlist empty!")
+        return
+    
+    text, keyboard = wishlist_page(books)
+    await callback_query.message.edit_text(text, reply_markup=keyboard)
+    await callback_query.answer()
+
+@callbacks.exact("view_all_wishlist")
+async def view_all_wishlist_callback(client: Client, callback_query: CallbackQuery, arg: str):
+    books = await db.get_user_wishlist(callback_query.from_user.id)
+    
+    if not books:
+        await callback_query.message.edit_text("📭 Your wishlist is empty.")
+        await callback_query.answer("Wishlist empty!")
+        return
+    
+    # Stay well inside Telegram's 4096-character message limit
+    text = f"📚 **YOUR WISHLIST ({len(books)})**\n\n"
+    for i, book in enumerate(books, 1):
+        line = f"{i}. **{book.title[:40]}** `{book.id}`\n"
+        if len(text) + len(line) > 3800:
+            text += f"… and {len(books) - i + 1} more"
+            break
+        text += line
+    
+    keyboard = [
+        [InlineKeyboardButton(f"📖 {book.title[:25]}", callback_data=f"get_{book.id}")]
+        for book in books[:10]
+    ]
+    keyboard.append([
+        InlineKeyboardButton("🗑️ Clear All", callback_data="clear_wishlist"),
+        InlineKeyboardButton("🔙 Back", callback_data="wishlist_view")
+    ])
+    
+    await callback_query.message.edit_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    await callback_query.answer()
+
+@callbacks.prefix("remove_wish_")
+async def remove_wish_callback(client: Client, callback_query: CallbackQuery, book_id: str):
+    user_id = callback_query.from_user.id
+    await db.remove_from_wishlist(user_id, book_id)
+    await callback_query.answer("Removed from wishlist!")
+    
+    # Refresh wishlist view
+    books = await db.get_user_wishlist(user_id)
+    
+    if books:
+        text, keyboard = wishlist_page(books)
+        await callback_query.message.edit_text(text, reply_markup=keyboard)
+    else:
+        await callback_query.message.edit_text("📭 Your wishlist is now empty.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="my_stats")]]))
+
+@callbacks.exact("clear_wishlist")
+async def clear_wishlist_callback(client: Client, callback_query: CallbackQuery, arg: str):
+    await db.users.update_one(
+        {"id": callback_query.from_user.id},
+        {"$set": {"wishlist": []}}
+    )
+    await callback_query.answer("Wishlist cleared!")
+    await callback_query.message.edit_text("📭 Your wishlist has been cleared.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="my_stats")]]))
+
+# Save book from callback
+@callbacks.prefix("save_")
+async def save_callback(client: Client, callback_query: CallbackQuery, book_id: str):
+    await db.add_to_wishlist(callback_query.from_user.id, book_id)
+    await callback_query.answer("✅ Book saved to wishlist!")
+
+# Random another
+@callbacks.exact("random_another")
+@callbacks.prefix("random_another_")
+async def random_another_callback(client: Client, callback_query: CallbackQuery, category: str):
+    if category.endswith("*"):
+        await send_random_book(callback_query.message, category[:-1], prefix=True)
+    else:
+        await send_random_book(callback_query.message, category)
+    await callback_query.answer()
+
+# Trending
+@callbacks.exact("trending")
+async def trending_callback(client: Client, callback_query: CallbackQuery, arg: str):
+    await send_trending(callback_query.message)
+    await callback_query.answer()
 
 # ========== FILE UPLOAD HANDLER ==========
 @app.on_message(filters.document & filters.user([config.OWNER_ID] + config.ADMIN_IDS))
+@instrumented("message")
 async def handle_file_upload(client: Client, message: Message):
-    """Handle file uploads from admin"""
+    """Queue file uploads from admin for batched ingestion"""
     try:
         if not message.document:
             return
         
-        file = message.document
-        file_name = file.file_name or "Unknown"
-        
-        # Send processing message
-        proc_msg = await message.reply("📦 **Processing upload...**")
-        
-        # Extract metadata
-        metadata = await file_processor.extract_metadata(file_name)
-        
-        # Clean filename
-        clean_name = await file_processor.clean_filename(file_name)
-        
-        # Forward to database channel
-        forwarded = await message.forward(config.DATABASE_CHANNEL_ID)
-        
-        # Create book object
-        book_id = str(uuid.uuid4())[:8].upper()
-        
-        book = Book(
-            id=book_id,
-            title=metadata['title'],
-            author=metadata['author'],
-            file_id=str(forwarded.id),
-            file_type=file_name.split('.')[-1].upper() if '.' in file_name else "PDF",
-            file_size=file.file_size,
-            file_name=clean_name,
-            category=metadata['category'],
-            added_by=message.from_user.id
-        )
-        
-        # Add to database
-        await db.add_book(book)
-        
-        # Send confirmation
-        await proc_msg.edit_text(
-            f"✅ **BOOK ADDED SUCCESSFULLY!**\n\n"
-            f"📖 **Title:** {book.title}\n"
-            f"👤 **Author:** {book.author}\n"
-            f"📦 **Size:** {file.file_size // 1024 // 1024}MB\n"
-            f"📄 **Format:** {book.file_type}\n"
-            f"🏷️ **Category:** {book.category}\n"
-            f"🆔 **ID:** `{book_id}`\n\n"
-            f"📊 Added to database"
-        )
-        
-        # Add reaction to admin message
-        await reaction_system.add_reaction(client, message.chat.id, message.id, 'owner')
+        batch = ingestion.submit(message)
         
-        # Log upload
-        logger.info(f"Admin {message.from_user.id} uploaded: {book.title}")
+        # React once per batch rather than once per file
+        if batch.received == 1:
+            reaction_system.react(client, message.chat.id, message.id, 'owner')
         
     except Exception as e:
         logger.error(f"Upload error: {e}")
         try:
-            await proc_msg.edit_text(f"❌ **Upload Failed!**\n\nError: {str(e)[:200]}")
+            await message.reply(f"❌ **Upload Failed!**\n\nError: {str(e)[:200]}")
         except:
             pass
 
 # ========== TEXT MESSAGE HANDLER (For reactions) ==========
 # Using custom filter instead of ~filters.command
 @app.on_message(filters.text)
+@instrumented("message")
 async def handle_text_message(client: Client, message: Message):
     """Add reactions to text messages"""
     try:
@@ -1606,7 +4361,7 @@ async def handle_text_message(client: Client, message: Message):
         if message.from_user and message.from_user.id in [config.OWNER_ID] + config.ADMIN_IDS:
             msg_type = 'owner'
         
-        await reaction_system.add_reaction(client, message.chat.id, message.id, msg_type)
+        reaction_system.react(client, message.chat.id, message.id, msg_type)
         
         # Also update user last active
         if message.from_user:
@@ -1636,7 +4391,7 @@ async def scheduled_tasks():
                 report = await analytics.generate_daily_report()
                 if config.OWNER_ID:
                     try:
-                        await app.send_message(config.OWNER_ID, report)
+                        await outbound.call(outbound.BACKGROUND, config.OWNER_ID, app.send_message, config.OWNER_ID, report)
                     except:
                         pass
                 
@@ -1649,20 +4404,10 @@ async def scheduled_tasks():
                 
                 logger.info("Midnight tasks completed")
             
-            # Clean old cache every hour
-            if now.minute == 0:
-                # Clean search manager cache
-                old_searches = []
-                current_time = datetime.now()
-                
-                for user_id, search_data in list(search_manager.active_searches.items()):
-                    if current_time - search_data['timestamp'] > timedelta(hours=1):
-                        old_searches.append(user_id)
-                
-                for user_id in old_searches:
-                    del search_manager.active_searches[user_id]
-                
-                logger.debug("Hourly cleanup completed")
+            # Expire idle search sessions
+            purged = search_manager.purge_expired()
+            if purged:
+                logger.debug(f"Purged {purged} expired search sessions")
             
             # Check every 5 minutes
             await asyncio.sleep(300)
@@ -1681,6 +4426,11 @@ async def main():
     
     # Start scheduled tasks
     asyncio.create_task(scheduled_tasks())
+    counter_task = asyncio.create_task(db.counters.run())
+    asyncio.create_task(db.trending.run(config.TRENDING_REFRESH_INTERVAL))
+    asyncio.create_task(metrics.watch_event_loop())
+    if config.METRICS_PORT:
+        asyncio.create_task(metrics.serve(config.METRICS_HOST, config.METRICS_PORT))
     
     # Start the bot
     await app.start()
@@ -1689,6 +4439,16 @@ async def main():
     bot_info = await app.get_me()
     logger.info(f"✅ Bot started: @{bot_info.username}")
     
+    # Pick up broadcasts and deletions interrupted by a restart
+    await broadcast_system.resume_interrupted(app)
+    await reindexer.resume_interrupted(app)
+    try:
+        await search_manager.deletions.load()
+    except Exception as e:
+        logger.error(f"Could not restore pending deletions: {e}")
+    asyncio.create_task(search_manager.deletions.run())
+    ingestion.start()
+    
     # Send startup message to owner
     if config.OWNER_ID:
         try:
@@ -1716,6 +4476,16 @@ async def main():
     except KeyboardInterrupt:
         logger.info("🛑 Received stop signal...")
     finally:
+        # Write books still buffered by the upload pipeline
+        await ingestion.stop()
+        
+        # Flush buffered counters before exiting
+        counter_task.cancel()
+        try:
+            await counter_task
+        except asyncio.CancelledError:
+            pass
+        
         # Stop the bot
         await app.stop()
         logger.info("👋 Bot stopped.")
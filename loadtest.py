@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+LOADTEST.PY - Offline load test for the bot's update handlers
+Drives the real handlers in bot.py with synthetic updates against a fake
+Telegram client (simulated API latency and FloodWait) and an in-memory MongoDB:
+
+    python loadtest.py --rate 50 --duration 20
+    python loadtest.py --updates 5000 --record trace.jsonl
+    python loadtest.py --replay trace.jsonl --rate 200 --latency-ms 80 --flood-rate 0.01
+
+The in-memory database needs mongomock-motor; pass --mongo-uri to use a real
+MongoDB instead (the --db-name database is dropped first).
+"""
+
+import argparse
+import asyncio
+import contextvars
+import json
+import logging
+import math
+import random
+import time
+from collections import Counter, deque
+from types import SimpleNamespace
+
+from pyrogram.errors import FloodWait
+from pyrogram.types import InlineKeyboardMarkup
+
+import bot
+from benchmark import make_filename
+
+SEARCH_TERMS = ["python", "history", "data science", "machine learning", "cooking", "finance",
+                "javascript", "physics", "novel", "marketing", "rome", "guide", "zzzz"]
+CATEGORY_BUTTONS = ["cat_programming", "cat_science", "cat_fiction", "cat_history", "cat_ai & ml"]
+
+# Update mix for generated traces: (weight, kind)
+UPDATE_MIX = [
+    (35, "books"), (20, "button"), (10, "get"), (5, "start"), (5, "trending"), (5, "random"),
+    (4, "save"), (4, "wishlist"), (3, "stats"), (3, "category"), (4, "text"), (2, "upload"),
+]
+
+current_label = contextvars.ContextVar("current_label", default="-")
+
+
+# ========== FAKE TELEGRAM ==========
+class FakeMessage:
+    """Just enough of pyrogram.types.Message for the handlers"""
+
+    def __init__(self, client, chat_id: int, message_id: int, user=None, text: str = "", document=None):
+        self._client = client
+        self.id = message_id
+        self.chat = SimpleNamespace(id=chat_id)
+        self.from_user = user
+        self.text = text
+        self.document = document
+        self.media_group_id = None
+        self.command = text[1:].split() if text.startswith("/") else None
+
+    async def reply(self, text, **kwargs):
+        return await self._client.send_message(self.chat.id, text, **kwargs)
+
+    reply_text = reply
+
+    async def edit_text(self, text, **kwargs):
+        await self._client.edit_message_text(self.chat.id, self.id, text, **kwargs)
+        self.text = text
+        return self
+
+    edit = edit_text
+
+    async def delete(self):
+        return await self._client.delete_messages(self.chat.id, self.id)
+
+    async def forward(self, chat_id):
+        return await self._client.forward_messages(chat_id, self.chat.id, self.id)
+
+
+class FakeCallbackQuery:
+    def __init__(self, client, query_id: str, user, message: FakeMessage, data: str):
+        self._client = client
+        self.id = query_id
+        self.from_user = user
+        self.message = message
+        self.data = data
+
+    async def answer(self, text: str = None, show_alert: bool = None, **kwargs):
+        return await self._client.answer_callback_query(self.id, text, show_alert=show_alert)
+
+
+class FakeClient:
+    """Records every API call, sleeping a simulated round trip and injecting FloodWait"""
+
+    def __init__(self, latency_ms: float, jitter_ms: float, flood_rate: float, flood_seconds: int, seed: int):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.floods = Counter()
+        self.buttons = {}  # user_id -> deque of (message_id, callback_data) the bot showed them
+        self._next_id = 1000
+
+    async def _api(self, method: str):
+        if bot.outbound.granted_here:
+            return await self.invoke(method)
+        # Like TracedClient.invoke: direct handler calls take a token on the edit lane
+        return await bot.outbound.call(bot.outbound.EDIT, None, self.invoke, method)
+
+    async def invoke(self, method: str):
+        """One simulated round trip (named like Client.invoke for the outbound metrics)"""
+        self.calls[method] += 1
+        if self.flood_rate and self.random.random() < self.flood_rate:
+            self.floods[method] += 1
+            raise FloodWait(value=self.flood_seconds)
+        await asyncio.sleep(max(0.0, self.random.gauss(self.latency_ms, self.jitter_ms)) / 1000)
+
+    def _new_message(self, chat_id: int, text: str = "") -> FakeMessage:
+        self._next_id += 1
+        return FakeMessage(self, chat_id, self._next_id, text=text)
+
+    def _remember_buttons(self, chat_id: int, message_id: int, reply_markup):
+        if not isinstance(reply_markup, InlineKeyboardMarkup):
+            return
+        seen = self.buttons.setdefault(chat_id, deque(maxlen=20))
+        for row in reply_markup.inline_keyboard:
+            for button in row:
+                if button.callback_data:
+                    seen.append((message_id, button.callback_data))
+
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        await self._api("send_message")
+        message = self._new_message(chat_id, text)
+        self._remember_buttons(chat_id, message.id, reply_markup)
+        return message
+
+    async def edit_message_text(self, chat_id, message_id, text, reply_markup=None, **kwargs):
+        await self._api("edit_message_text")
+        self._remember_buttons(chat_id, message_id, reply_markup)
+
+    async def copy_message(self, chat_id, from_chat_id, message_id, **kwargs):
+        await self._api("copy_message")
+        return self._new_message(chat_id)
+
+    async def forward_messages(self, chat_id, from_chat_id, message_ids, **kwargs):
+        await self._api("forward_messages")
+        return self._new_message(chat_id)
+
+    async def delete_messages(self, chat_id, message_ids, **kwargs):
+        await self._api("delete_messages")
+        return True
+
+    async def send_reaction(self, chat_id, message_id, emoji=None, **kwargs):
+        await self._api("send_reaction")
+        return True
+
+    async def answer_callback_query(self, callback_query_id, text=None, show_alert=None, **kwargs):
+        await self._api("answer_callback_query")
+        return True
+
+    async def get_me(self):
+        return SimpleNamespace(id=1, username=bot.config.BOT_USERNAME or "loadtest_bot")
+
+
+# ========== TRACES ==========
+def generate_trace(count: int, users: int, books: int, seed: int) -> list:
+    """Synthetic updates drawn from UPDATE_MIX"""
+    rng = random.Random(seed)
+    weights, kinds = zip(*UPDATE_MIX)
+    owner = bot.config.OWNER_ID
+    events = []
+    for i in range(count):
+        kind = rng.choices(kinds, weights)[0]
+        user = rng.randint(10_000, 10_000 + users - 1)
+        if kind == "books":
+            events.append({"type": "command", "user": user, "text": f"/books {rng.choice(SEARCH_TERMS)}"})
+        elif kind == "button":
+            events.append({"type": "callback", "user": user, "data": "@button"})  # a button the bot showed
+        elif kind == "get":
+            events.append({"type": "callback", "user": user, "data": f"get_LT{rng.randrange(books):06d}"})
+        elif kind == "category":
+            events.append({"type": "callback", "user": user, "data": rng.choice(CATEGORY_BUTTONS)})
+        elif kind == "save":
+            events.append({"type": "command", "user": user, "text": f"/save LT{rng.randrange(books):06d}"})
+        elif kind == "text":
+            events.append({"type": "text", "user": user, "text": "thanks!"})
+        elif kind == "upload":
+            events.append({"type": "upload", "user": owner, "file_name": make_filename(),
+                           "file_size": rng.randint(100_000, 20_000_000), "file_unique_id": f"up{seed}-{i}"})
+        else:
+            events.append({"type": "command", "user": user, "text": f"/{kind}"})
+    return events
+
+
+def load_trace(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def save_trace(path: str, events: list) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        for event in events:
+            f.write(json.dumps(event) + "\n")
+
+
+# ========== HARNESS ==========
+class ErrorCounter(logging.Handler):
+    """Count ERROR log records against the update being handled"""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.errors = Counter()
+
+    def emit(self, record):
+        self.errors[current_label.get()] += 1
+
+
+COMMANDS = {
+    "start": bot.start_command, "help": bot.help_command, "books": bot.books_command,
+    "categories": bot.categories_command, "trending": bot.trending_command, "stats": bot.stats_command,
+    "save": bot.save_command, "wishlist": bot.wishlist_command, "random": bot.random_command,
+}
+
+
+class Harness:
+    def __init__(self, client: FakeClient, seed: int):
+        self.client = client
+        self.random = random.Random(seed)
+        self.samples = {}  # label -> [seconds]
+        self.exceptions = Counter()
+        self._query_id = 0
+
+    def _user(self, user_id: int):
+        return SimpleNamespace(id=user_id, username=f"user{user_id}", first_name="Load", is_bot=False)
+
+    def _build(self, event: dict):
+        """Turn a trace event into (label, handler, update)"""
+        user = self._user(event["user"])
+        kind = event["type"]
+
+        if kind == "callback":
+            data = event["data"]
+            message_id = self.client._next_id
+            if data == "@button":
+                shown = self.client.buttons.get(user.id)
+                message_id, data = self.random.choice(shown) if shown else (message_id, "trending")
+            route, _ = bot.callbacks.resolve(data)
+            self._query_id += 1
+            message = FakeMessage(self.client, user.id, message_id, user)
+            query = FakeCallbackQuery(self.client, str(self._query_id), user, message, data)
+            return f"cb:{route.key if route else 'unknown'}", bot.handle_callback_query, query
+
+        self.client._next_id += 1
+        if kind == "upload":
+            document = SimpleNamespace(file_name=event["file_name"], file_size=event["file_size"],
+                                       file_unique_id=event["file_unique_id"])
+            message = FakeMessage(self.client, user.id, self.client._next_id, user, document=document)
+            return "upload", bot.handle_file_upload, message
+
+        message = FakeMessage(self.client, user.id, self.client._next_id, user, text=event["text"])
+        if kind == "text":
+            return "text", bot.handle_text_message, message
+        name = message.command[0]
+        return f"/{name}", COMMANDS[name], message
+
+    async def run_event(self, event: dict, due: float):
+        label, handler, update = self._build(event)
+        current_label.set(label)
+        try:
+            await handler(self.client, update)
+        except Exception:
+            self.exceptions[label] += 1
+        self.samples.setdefault(label, []).append(time.perf_counter() - due)
+
+    async def replay(self, events: list, rate: float) -> float:
+        """Open-loop replay: update i starts at i / rate whether or not earlier ones finished"""
+        start = time.perf_counter()
+        tasks = []
+        for i, event in enumerate(events):
+            due = start + i / rate
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self.run_event(event, due)))
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - start
+
+
+def percentile(sorted_samples: list, q: float) -> float:
+    return sorted_samples[max(0, math.ceil(q * len(sorted_samples)) - 1)]
+
+
+def report(harness: Harness, errors: Counter, elapsed: float, rate: float) -> None:
+    total = sum(len(samples) for samples in harness.samples.values())
+    print(f"\n🧪 Replayed {total:,} updates in {elapsed:.1f}s "
+          f"({total / elapsed:.1f} updates/s, target {rate:g}/s)")
+    print("-" * 90)
+    print(f"{'handler':<26}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for label, samples in sorted(harness.samples.items(), key=lambda item: -len(item[1])):
+        samples.sort()
+        failed = errors[label] + harness.exceptions[label]
+        print(f"{label:<26}{len(samples):>8}{failed:>8}"
+              f"{percentile(samples, 0.50) * 1000:>10.1f}{percentile(samples, 0.95) * 1000:>10.1f}"
+              f"{percentile(samples, 0.99) * 1000:>10.1f}{samples[-1] * 1000:>10.1f}")
+
+    client = harness.client
+    print("\n📡 Fake Telegram API: " + ", ".join(f"{name} {n:,}" for name, n in client.calls.most_common()))
+    if client.floods:
+        print("⏳ FloodWait injected: " + ", ".join(f"{name} {n}" for name, n in client.floods.most_common()))
+    print("🚦 Outbound lanes: " + ", ".join(
+        f"{name} avg wait {lane['avg_wait'] * 1000:.0f}ms / max {lane['max_wait'] * 1000:.0f}ms"
+        for name, lane in bot.outbound.stats().items() if lane["granted"]
+    ))
+
+
+async def setup(args, client: FakeClient) -> None:
+    """Point bot.py at the fake client and a throwaway database, then seed books"""
+    bot.config.OWNER_ID = bot.config.OWNER_ID or 1
+    bot.config.DATABASE_CHANNEL_ID = bot.config.DATABASE_CHANNEL_ID or -100
+    bot.app = client
+
+    if args.mongo_uri:
+        bot.config.MONGO_URI = args.mongo_uri
+        bot.config.DATABASE_NAME = args.db_name
+        bot.db = bot.Database()
+        await bot.db.client.drop_database(args.db_name)
+    else:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            raise SystemExit("❌ Install mongomock-motor for the in-memory database, or pass --mongo-uri")
+        motor_client = bot.motor.motor_asyncio.AsyncIOMotorClient
+        bot.motor.motor_asyncio.AsyncIOMotorClient = lambda *a, **k: AsyncMongoMockClient()
+        try:
+            bot.db = bot.Database()
+        finally:
+            bot.motor.motor_asyncio.AsyncIOMotorClient = motor_client
+
+    await bot.db.initialize()
+
+    random.seed(args.seed)
+    filenames = [make_filename() for _ in range(args.books)]
+    books = []
+    for i, (file_name, metadata) in enumerate(zip(filenames, bot.FileProcessor.extract_metadata_batch(filenames))):
+        book = bot.FileProcessor.build_book(
+            file_name, random.randint(100_000, 20_000_000), 10_000 + i, bot.config.OWNER_ID,
+            metadata, bot.FileProcessor.clean_filename_sync(file_name)
+        )
+        book.id = f"LT{i:06d}"
+        book.file_unique_id = f"seed-{i}"
+        books.append(book)
+    for i in range(0, len(books), 1000):
+        await bot.db.add_books(books[i:i + 1000])
+    print(f"📚 Seeded {len(books):,} books ({bot.config.SEARCH_MODE} search)")
+
+
+async def run(args) -> None:
+    client = FakeClient(args.latency_ms, args.jitter_ms, args.flood_rate, args.flood_seconds, args.seed)
+    await setup(args, client)
+
+    if args.replay:
+        events = load_trace(args.replay)
+    else:
+        count = args.updates or int(args.rate * args.duration)
+        events = generate_trace(count, args.users, args.books, args.seed)
+    if args.record:
+        save_trace(args.record, events)
+        print(f"💾 Trace written to {args.record}")
+
+    errors = ErrorCounter()
+    logging.getLogger("bot").addHandler(errors)
+    background = [
+        asyncio.create_task(bot.db.counters.run()),
+        asyncio.create_task(bot.search_manager.deletions.run()),
+    ]
+    bot.ingestion.start()
+
+    harness = Harness(client, args.seed)
+    elapsed = await harness.replay(events, args.rate)
+
+    await bot.ingestion.queue.join()
+    await bot.ingestion.stop()
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+
+    report(harness, errors.errors, elapsed, args.rate)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline load test for the book bot's handlers")
+    parser.add_argument("--rate", type=float, default=50, help="updates per second")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of generated traffic")
+    parser.add_argument("--updates", type=int, help="number of generated updates (overrides --duration)")
+    parser.add_argument("--replay", help="JSONL trace to replay instead of generating one")
+    parser.add_argument("--record", help="write the trace used to this JSONL file")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--books", type=int, default=20_000)
+    parser.add_argument("--latency-ms", type=float, default=60, help="simulated Telegram round trip")
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="chance an API call raises FloodWait")
+    parser.add_argument("--flood-seconds", type=int, default=1)
+    parser.add_argument("--mongo-uri", help="use a real MongoDB instead of mongomock-motor")
+    parser.add_argument("--db-name", default="book_bot_loadtest")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--verbose", action="store_true", help="show the bot's INFO logs")
+    args = parser.parse_args()
+
+    logging.getLogger("bot").setLevel(logging.INFO if args.verbose else logging.WARNING)
+    bot.tracer.slow_seconds = math.inf  # keep slow-trace dumps out of load-test runs
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
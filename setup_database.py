@@ -59,8 +59,25 @@ def setup_database():
         # Create indexes
         db.books.create_index([("title", "text"), ("author", "text"), ("category", "text")])
         db.books.create_index([("id", 1)], unique=True)
+        db.books.create_index([("title", 1)])
+        db.books.create_index([("author", 1)])
+        db.books.create_index([("downloads", -1), ("id", 1)])
+        db.books.create_index([("category", 1)])
+        db.books.create_index([("category_key", 1)])
+        db.books.create_index([("file_id", 1)])
+        db.books.create_index(
+            [("file_unique_id", 1)], unique=True,
+            partialFilterExpression={"file_unique_id": {"$type": "string"}}
+        )
         db.users.create_index([("id", 1)], unique=True)
+        db.users.create_index([("blocked_at", 1), ("id", 1)])
         db.stats.create_index([("key", 1)], unique=True)
+        db.book_activity.create_index([("bucket", 1), ("book_id", 1)], unique=True)
+        db.book_activity.create_index([("bucket", 1)], name="bucket_ttl", expireAfterSeconds=7 * 86400)
+        db.broadcasts.create_index([("job_id", 1)], unique=True)
+        db.broadcasts.create_index([("status", 1)])
+        db.pending_deletions.create_index([("chat_id", 1), ("message_id", 1)], unique=True)
+        db.reindex_jobs.create_index([("status", 1)])
         
         print("✅ Created indexes")
         